@@ -6,15 +6,73 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 import hashlib
+import hmac
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
 import urllib.request
 import urllib.error
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configurações Supabase
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
 
+# Tamanho dos pedaços lidos do Supabase e escritos na resposta
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Limites do /api/batch
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '20'))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '4'))
+
+# Profiling: X-Profile/?__profile= com o segredo, ou requisições acima de SLOW_REQUEST_MS
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1500'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'vitrine_profiles'))
+PROFILE_RING_SIZE = int(os.environ.get('PROFILE_RING_SIZE', '50'))
+
+class RequestMemo:
+    """Leituras compartilhadas entre as sub-requisições de um mesmo lote"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+    
+    def get_or_call(self, key, call):
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+        if owner:
+            try:
+                future.set_result(call())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+request_memo = ContextVar('request_memo', default=None)
+
 def supabase_request(endpoint, method='GET', data=None):
     """Fazer request para Supabase REST API"""
+    memo = request_memo.get()
+    if memo is not None and method == 'GET':
+        return memo.get_or_call(endpoint, lambda: _supabase_request(endpoint))
+    return _supabase_request(endpoint, method, data)
+
+def _supabase_request(endpoint, method='GET', data=None):
     url = f"{SUPABASE_URL}/rest/v1/{endpoint}"
     headers = {
         'apikey': SUPABASE_KEY,
@@ -26,6 +84,7 @@ def supabase_request(endpoint, method='GET', data=None):
     req_data = json.dumps(data).encode() if data else None
     req = urllib.request.Request(url, data=req_data, headers=headers, method=method)
     
+    started = time.perf_counter()
     try:
         with urllib.request.urlopen(req) as response:
             return json.loads(response.read().decode())
@@ -33,74 +92,648 @@ def supabase_request(endpoint, method='GET', data=None):
         return {'error': e.read().decode()}
     except Exception as e:
         return {'error': str(e)}
+    finally:
+        record_upstream(method, endpoint, started)
+
+def iter_json_array(chunks):
+    """Recebe pedaços de um array JSON e devolve os bytes de cada elemento"""
+    depth = 0
+    in_string = False
+    escaped = False
+    started = False
+    item = bytearray()
+    
+    for chunk in chunks:
+        start = 0
+        for i, byte in enumerate(chunk):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif byte == 0x5C:  # barra invertida
+                    escaped = True
+                elif byte == 0x22:  # "
+                    in_string = False
+                continue
+            if byte == 0x22:
+                in_string = True
+            elif byte in (0x5B, 0x7B):  # [ {
+                depth += 1
+                if depth == 1:
+                    started = byte == 0x5B
+                    if not started:
+                        raise ValueError('Resposta do Supabase não é uma lista')
+                    start = i + 1
+            elif byte in (0x5D, 0x7D):  # ] }
+                depth -= 1
+                if depth == 0:
+                    item += chunk[start:i]
+                    if item.strip():
+                        yield bytes(item)
+                    return
+            elif byte == 0x2C and depth == 1:  # ,
+                item += chunk[start:i]
+                yield bytes(item)
+                item = bytearray()
+                start = i + 1
+        if started:
+            item += chunk[start:]
+    # Corpo acabou antes do "]": conexão caiu no meio da listagem
+    raise ValueError('Listagem do Supabase incompleta')
+
+def supabase_stream(endpoint):
+    """Abrir uma listagem do Supabase e devolver o iterador dos itens.
+    
+    Erro HTTP ou de conexão sobe aqui, antes de qualquer byte ir ao cliente;
+    falha no meio do corpo sobe durante a iteração.
+    """
+    url = f"{SUPABASE_URL}/rest/v1/{endpoint}"
+    headers = {
+        'apikey': SUPABASE_KEY,
+        'Authorization': f'Bearer {SUPABASE_KEY}',
+    }
+    req = urllib.request.Request(url, headers=headers, method='GET')
+    
+    started = time.perf_counter()
+    try:
+        response = urllib.request.urlopen(req)
+    except Exception:
+        record_upstream('GET', endpoint, started)
+        raise
+    return _iter_listing(response, endpoint, started)
+
+def _iter_listing(response, endpoint, started):
+    try:
+        with response:
+            yield from iter_json_array(iter(lambda: response.read(STREAM_CHUNK_SIZE), b''))
+    finally:
+        record_upstream('GET', endpoint, started)
+
+def dumps(data):
+    """Serializar para bytes com orjson quando disponível"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False).encode()
+
+def loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+class Listing:
+    """Listagem do Supabase que o handler envia em streaming"""
+    
+    def __init__(self, key, endpoint, extra=None):
+        self.key = key
+        self.endpoint = endpoint
+        self.extra = extra or {}
+    
+    def materialize(self):
+        items = supabase_request(self.endpoint)
+        if not isinstance(items, list):
+            # Sem version: o cliente de delta-sync não pode guardar uma lista incompleta
+            error = items.get('error') if isinstance(items, dict) else items
+            return {'success': False, 'message': str(error)}
+        return {'success': True, self.key: items, **self.extra}
+
+# ============================================
+# Rotas GET
+# ============================================
+
+def api_status(params, query, data):
+    return {
+        'success': True,
+        'message': '🏍️ Vitrine do Vendedor API está online!',
+        'version': '1.0.0',
+        'database': 'Supabase conectado' if SUPABASE_URL else 'Não configurado'
+    }
+
+def list_vitrines(params, query, data):
+    # Listagens que crescem com o número de vitrines/produtos vão em streaming
+    return Listing('vitrines', 'vitrines?is_active=eq.true&select=*')
+
+def get_vitrine(params, query, data):
+    vitrine = supabase_request(f"vitrines?slug=eq.{params['slug']}&select=*,produtos(*)")
+    if vitrine and isinstance(vitrine, list) and len(vitrine) > 0:
+        return {'success': True, 'vitrine': vitrine[0]}
+    return {'success': False, 'message': 'Vitrine não encontrada'}
+
+def list_produtos(params, query, data):
+    vitrine_id = query.get('vitrine_id')
+    if not vitrine_id:
+        return {'success': False, 'message': 'vitrine_id necessário'}
+    since = query.get('since')
+    if since is not None:
+        if not since.isdigit():
+            return {'success': False, 'message': 'since deve ser um número'}
+        return sync_produtos(vitrine_id, int(since))
+    # Versão lida antes da listagem: no pior caso o cliente recebe uma linha de novo
+    return Listing('produtos', f'produtos?vitrine_id=eq.{vitrine_id}&select=*',
+                   extra={'version': produtos_version(vitrine_id), 'full': True})
+
+def produtos_version(vitrine_id):
+    """Maior row_version da vitrine, contando produtos removidos (tombstones)"""
+    version = 0
+    for table in ('produtos', 'produto_tombstones'):
+        rows = supabase_request(f'{table}?vitrine_id=eq.{vitrine_id}&select=row_version&order=row_version.desc&limit=1')
+        if rows and isinstance(rows, list):
+            version = max(version, rows[0].get('row_version') or 0)
+    return version
+
+def sync_produtos(vitrine_id, since):
+    """Só o que mudou desde a versão since: produtos alterados e ids removidos"""
+    produtos = supabase_request(
+        f'produtos?vitrine_id=eq.{vitrine_id}&row_version=gt.{since}&select=*&order=row_version')
+    removed = supabase_request(
+        f'produto_tombstones?vitrine_id=eq.{vitrine_id}&row_version=gt.{since}&select=produto_id,row_version&order=row_version')
+    if not isinstance(produtos, list) or not isinstance(removed, list):
+        error = produtos if not isinstance(produtos, list) else removed
+        return {'success': False, 'message': str(error.get('error') if isinstance(error, dict) else error)}
+    
+    version = max([since] + [p.get('row_version') or 0 for p in produtos] + [t['row_version'] for t in removed])
+    return {
+        'success': True,
+        'produtos': produtos,
+        'deleted': [{'id': t['produto_id'], 'version': t['row_version']} for t in removed],
+        'version': version,
+        'full': False
+    }
+
+def get_user(params, query, data):
+    users = supabase_request(f"users?id=eq.{params['user_id']}&select=id,name,email,phone")
+    if users and isinstance(users, list) and len(users) > 0:
+        return {'success': True, 'user': users[0]}
+    return {'success': False, 'message': 'Usuário não encontrado'}
+
+# ============================================
+# Rotas POST / DELETE
+# ============================================
+
+def register(params, query, data):
+    # Verificar se email já existe
+    existing = supabase_request(f"users?email=eq.{data.get('email')}&select=id")
+    if existing and isinstance(existing, list) and len(existing) > 0:
+        return {'success': False, 'message': 'Email já cadastrado'}
+    
+    user_data = {
+        'name': data.get('name'),
+        'email': data.get('email'),
+        'password_hash': hash_password(data.get('password', '')),
+        'phone': data.get('phone', ''),
+        'role': 'user',
+        'status': 'active'
+    }
+    result = supabase_request('users', 'POST', user_data)
+    if 'error' in result:
+        return {'success': False, 'message': str(result['error'])}
+    user = result[0] if isinstance(result, list) else result
+    return {
+        'success': True,
+        'message': 'Usuário cadastrado com sucesso!',
+        'user': {'id': user.get('id'), 'name': user.get('name'), 'email': user.get('email')}
+    }
+
+def login(params, query, data):
+    email = data.get('email')
+    password_hash = hash_password(data.get('password', ''))
+    users = supabase_request(f'users?email=eq.{email}&password_hash=eq.{password_hash}&select=*')
+    
+    if users and isinstance(users, list) and len(users) > 0:
+        user = users[0]
+        return {
+            'success': True,
+            'message': 'Login realizado com sucesso!',
+            'user': {
+                'id': user['id'],
+                'name': user['name'],
+                'email': user['email'],
+                'phone': user.get('phone', '')
+            }
+        }
+    return {'success': False, 'message': 'Email ou senha incorretos'}
+
+def save_vitrine(params, query, data):
+    vitrine_data = {
+        'user_id': data.get('user_id'),
+        'name': data.get('name'),
+        'slug': data.get('slug'),
+        'description': data.get('description', ''),
+        'whatsapp': data.get('whatsapp', ''),
+        'instagram': data.get('instagram', ''),
+        'address': data.get('address', ''),
+        'city': data.get('city', ''),
+        'state': data.get('state', ''),
+        'is_active': data.get('is_active', True)
+    }
+    
+    # Verificar se já existe vitrine para este usuário
+    existing = supabase_request(f"vitrines?user_id=eq.{data.get('user_id')}&select=id")
+    
+    if existing and isinstance(existing, list) and len(existing) > 0:
+        # Atualizar
+        vitrine_id = existing[0]['id']
+        result = supabase_request(f'vitrines?id=eq.{vitrine_id}', 'PATCH', vitrine_data)
+    else:
+        # Criar
+        result = supabase_request('vitrines', 'POST', vitrine_data)
+    
+    if 'error' in result:
+        return {'success': False, 'message': str(result['error'])}
+    vitrine = result[0] if isinstance(result, list) else result
+    return {'success': True, 'message': 'Vitrine salva!', 'vitrine': vitrine}
+
+def create_produto(params, query, data):
+    produto_data = {
+        'vitrine_id': data.get('vitrine_id'),
+        'name': data.get('name'),
+        'description': data.get('description', ''),
+        'price': data.get('price'),
+        'year': data.get('year'),
+        'km': data.get('km'),
+        'color': data.get('color', ''),
+        'image_url': data.get('image_url', ''),
+        'images': data.get('images', ''),
+        'is_active': True
+    }
+    result = supabase_request('produtos', 'POST', produto_data)
+    if 'error' in result:
+        return {'success': False, 'message': str(result['error'])}
+    produto = result[0] if isinstance(result, list) else result
+    return {'success': True, 'message': 'Produto adicionado!', 'produto': produto}
+
+def delete_produto(params, query, data):
+    result = supabase_request(f"produtos?id=eq.{params['produto_id']}", 'DELETE')
+    if isinstance(result, dict) and 'error' in result:
+        return {'success': False, 'message': str(result['error'])}
+    return {'success': True, 'message': 'Produto removido!'}
+
+def run_batch(params, query, data):
+    """Executar várias sub-requisições num único round trip (painel)"""
+    subrequests = data.get('requests')
+    if not isinstance(subrequests, list) or not all(isinstance(sub, dict) for sub in subrequests):
+        return {'success': False, 'message': 'Envie {"requests": [{"method", "path", "body"}]}'}
+    if len(subrequests) > BATCH_MAX_SIZE:
+        return {'success': False, 'message': f'Máximo de {BATCH_MAX_SIZE} sub-requisições por lote'}
+    
+    responses = [None] * len(subrequests)
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_MAX_WORKERS, len(subrequests)))) as executor:
+        for wave in batch_waves(enumerate(subrequests)):
+            # Mesmo endpoint lido por várias sub-requisições da onda vai ao
+            # Supabase uma vez só; memo novo por onda por causa das escritas
+            token = request_memo.set(RequestMemo())
+            try:
+                futures = [(position, executor.submit(copy_context().run, run_subrequest, sub)) for position, sub in wave]
+                for position, future in futures:
+                    responses[position] = future.result()
+            finally:
+                request_memo.reset(token)
+    return {'success': True, 'responses': responses}
+
+def batch_waves(subrequests):
+    """Leituras consecutivas rodam juntas; cada escrita roda sozinha, na ordem enviada"""
+    wave = []
+    for position, sub in subrequests:
+        if (sub.get('method') or 'GET').upper() == 'GET':
+            wave.append((position, sub))
+            continue
+        if wave:
+            yield wave
+            wave = []
+        yield [(position, sub)]
+    if wave:
+        yield wave
+
+def run_subrequest(sub):
+    method = (sub.get('method') or 'GET').upper()
+    path = sub.get('path') or ''
+    normalized = normalize_path(urlsplit(path).path)
+    if not path.startswith('/') or normalized == '/api/batch' or normalized.startswith('/api/admin'):
+        return {'id': sub.get('id'), 'body': {'success': False, 'message': 'path inválido'}}
+    try:
+        result = dispatch(method, path, sub.get('body') or {})
+        if isinstance(result, Listing):
+            result = result.materialize()
+    except Exception as e:
+        result = {'success': False, 'message': str(e)}
+    return {'id': sub.get('id'), 'body': result}
+
+# ============================================
+# Profiling de requisições
+# ============================================
+
+# Chamadas ao Supabase da requisição atual
+upstream_calls = ContextVar('upstream_calls', default=None)
+
+def record_upstream(method, endpoint, started):
+    calls = upstream_calls.get()
+    if calls is not None:
+        # Só a tabela: a query pode ter email/hash de senha
+        calls.append({'call': f"{method} {endpoint.split('?')[0]}", 'ms': round((time.perf_counter() - started) * 1000, 1)})
+
+def collapse(frame):
+    """Pilha no formato "collapsed" do flamegraph.pl/speedscope (raiz primeiro)"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+class RequestProfiler:
+    """Amostra a pilha das requisições perfiladas sob demanda ou que passaram
+    de slow_ms, e guarda os perfis num anel de arquivos JSON em directory"""
+    
+    def __init__(self, directory, secret='', slow_ms=1500, ring_size=50, interval=0.005):
+        self.directory = directory
+        self.secret = secret
+        self.slow_ms = slow_ms
+        self.ring_size = ring_size
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler = None
+    
+    def is_authorized(self, token):
+        return bool(self.secret) and bool(token) and hmac.compare_digest(token, self.secret)
+    
+    def begin(self, method, path, forced=False):
+        if not self.secret and self.slow_ms <= 0:
+            return None
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._sampler.start()
+        calls = []
+        active = {
+            'method': method, 'path': path, 'forced': forced, 'started': time.perf_counter(),
+            'samples': Counter(), 'calls': calls, 'token': upstream_calls.set(calls)
+        }
+        with self._lock:
+            self._active[threading.get_ident()] = active
+        self._wakeup.set()
+        return active
+    
+    def end(self, active, status=None):
+        if active is None:
+            return None
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        upstream_calls.reset(active['token'])
+        elapsed_ms = (time.perf_counter() - active['started']) * 1000
+        if not active['forced'] and (self.slow_ms <= 0 or elapsed_ms < self.slow_ms):
+            return None
+        return self._save(active, elapsed_ms, status)
+    
+    def list_profiles(self):
+        try:
+            names = sorted((name for name in os.listdir(self.directory) if name.endswith('.json')), reverse=True)
+        except FileNotFoundError:
+            return []
+        profiles = []
+        for name in names:
+            profile = self.load(name[:-5])
+            if profile is not None:
+                profile.pop('stacks', None)
+                profiles.append(profile)
+        return profiles
+    
+    def load(self, profile_id):
+        if not profile_id or os.path.basename(profile_id) != profile_id:
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + '.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _next_wait(self):
+        """Segundos até a próxima amostra: 0 já amostra, None espera um begin()"""
+        if any(active['forced'] for active in self._active.values()):
+            return 0
+        if not self._active or self.slow_ms <= 0:
+            return None
+        deadline = min(active['started'] for active in self._active.values()) + self.slow_ms / 1000
+        return max(0, deadline - time.perf_counter())
+    
+    def _run(self):
+        while True:
+            # Sem requisição forçada, dorme até a mais antiga virar lenta
+            with self._lock:
+                wait = self._next_wait()
+                if wait != 0:
+                    self._wakeup.clear()
+            if wait != 0:
+                self._wakeup.wait(wait)
+                continue
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                targets = [
+                    (thread_id, active) for thread_id, active in self._active.items()
+                    if active['forced'] or (self.slow_ms > 0 and (now - active['started']) * 1000 >= self.slow_ms)
+                ]
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for thread_id, active in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    active['samples'][collapse(frame)] += 1
+    
+    def _save(self, active, elapsed_ms, status):
+        profile_id = f'{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}'
+        profile = {
+            'id': profile_id,
+            'kind': 'on_demand' if active['forced'] else 'slow',
+            'method': active['method'],
+            'path': active['path'],
+            'status': status,
+            'duration_ms': round(elapsed_ms, 1),
+            'created_at': time.time(),
+            'interval_ms': self.interval * 1000,
+            'samples': sum(active['samples'].values()),
+            'upstream': active['calls'],
+            'upstream_ms': round(sum(call['ms'] for call in active['calls']), 1),
+            'stacks': '\n'.join(f'{stack} {count}' for stack, count in active['samples'].most_common())
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(profile, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.directory, profile_id + '.json'))
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+            for name in names[:max(0, len(names) - self.ring_size)]:
+                os.unlink(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        return profile_id
+
+profiler = RequestProfiler(PROFILE_DIR, PROFILE_SECRET, SLOW_REQUEST_MS, PROFILE_RING_SIZE)
+
+def list_profiles(params, query, data):
+    return {'success': True, 'profiles': profiler.list_profiles()}
+
+def get_profile(params, query, data):
+    profile = profiler.load(params['profile_id'])
+    if profile is None:
+        return {'success': False, 'message': 'Perfil não encontrado'}
+    return {'success': True, 'profile': profile}
+
+# ============================================
+# Tabela de rotas
+# ============================================
+
+ROUTES = [
+    ('GET', '/api', api_status),
+    ('GET', '/api/vitrines', list_vitrines),
+    ('GET', '/api/vitrine/<slug>', get_vitrine),
+    ('GET', '/api/produtos', list_produtos),
+    ('GET', '/api/user/<user_id>', get_user),
+    ('POST', '/api/auth/register', register),
+    ('POST', '/api/auth/login', login),
+    ('POST', '/api/vitrines', save_vitrine),
+    ('POST', '/api/produtos', create_produto),
+    ('POST', '/api/batch', run_batch),
+    ('DELETE', '/api/produtos/<produto_id>', delete_produto),
+    ('GET', '/api/admin/profiles', list_profiles),
+    ('GET', '/api/admin/profiles/<profile_id>', get_profile),
+]
+
+def compile_routes(routes):
+    """Rotas fixas vão num dict; as com parâmetros viram uma única regex por método"""
+    static = {}
+    patterns = {}
+    groups = {}
+    for index, (method, pattern, func) in enumerate(routes):
+        if '<' not in pattern:
+            static[(method, pattern)] = func
+            continue
+        group = f'r{index}'
+        names = re.findall(r'<(\w+)>', pattern)
+        regex = re.sub(r'<(\w+)>', lambda m: f'(?P<{group}_{m.group(1)}>[^/]+)', re.escape(pattern))
+        patterns.setdefault(method, []).append(f'(?P<{group}>{regex})')
+        groups[group] = (func, names)
+    dynamic = {method: re.compile('|'.join(alternatives)) for method, alternatives in patterns.items()}
+    return static, dynamic, groups
+
+STATIC_ROUTES, DYNAMIC_ROUTES, ROUTE_GROUPS = compile_routes(ROUTES)
+
+def normalize_path(path):
+    return path.rstrip('/') or '/'
+
+def dispatch(method, raw_path, data=None):
+    parts = urlsplit(raw_path)
+    path = normalize_path(parts.path)
+    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    
+    func = STATIC_ROUTES.get((method, path))
+    params = {}
+    if func is None and method in DYNAMIC_ROUTES:
+        match = DYNAMIC_ROUTES[method].fullmatch(path)
+        if match:
+            func, names = ROUTE_GROUPS[match.lastgroup]
+            params = {name: match.group(f'{match.lastgroup}_{name}') for name in names}
+    
+    if func is None:
+        return {'success': False, 'message': 'Endpoint não encontrado'}
+    return func(params, query, data if data is not None else {})
+
 class handler(BaseHTTPRequestHandler):
     def send_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, X-Profile')
+        self.send_header('Access-Control-Expose-Headers', 'X-Sync-Version, X-Sync-Full')
     
-    def do_OPTIONS(self):
+    def wants_ndjson(self):
+        accept = (self.headers.get('Accept') or '').lower()
+        return 'application/x-ndjson' in accept or 'application/ndjson' in accept
+    
+    def send_json(self, response):
         self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
         self.send_cors_headers()
         self.end_headers()
+        self.wfile.write(dumps(response))
     
-    def do_GET(self):
+    def send_listing(self, listing):
+        """Abrir a listagem no Supabase antes de responder, e só então enviar em streaming"""
+        ndjson = self.wants_ndjson()
+        try:
+            items = supabase_stream(listing.endpoint)
+            if ndjson and listing.extra:
+                # No NDJSON a versão vai em header, antes dos itens: lê tudo primeiro
+                items = list(items)
+        except Exception as e:
+            return self.send_json({'success': False, 'message': str(e)})
+        self.send_stream(listing.key, items, listing.extra, ndjson)
+    
+    def send_stream(self, key, items, extra=None, ndjson=False):
+        """Escrever uma listagem item a item (array JSON, ou NDJSON via Accept)"""
         self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', 'application/x-ndjson' if ndjson else 'application/json')
+        if ndjson:
+            # NDJSON não tem envelope: campos extras (ex.: version) vão em headers
+            for name, value in (extra or {}).items():
+                self.send_header(f'X-Sync-{name.title()}', str(value))
         self.send_cors_headers()
         self.end_headers()
         
-        path = self.path
-        
-        # Status da API
-        if path == '/api' or path == '/api/':
-            response = {
-                'success': True,
-                'message': '🏍️ Vitrine do Vendedor API está online!',
-                'version': '1.0.0',
-                'database': 'Supabase conectado' if SUPABASE_URL else 'Não configurado'
-            }
-        
-        # Listar vitrines públicas
-        elif path.startswith('/api/vitrines'):
-            vitrines = supabase_request('vitrines?is_active=eq.true&select=*')
-            response = {'success': True, 'vitrines': vitrines if isinstance(vitrines, list) else []}
-        
-        # Vitrine por slug
-        elif '/api/vitrine/' in path:
-            slug = path.split('/api/vitrine/')[-1].split('?')[0]
-            vitrine = supabase_request(f'vitrines?slug=eq.{slug}&select=*,produtos(*)')
-            if vitrine and isinstance(vitrine, list) and len(vitrine) > 0:
-                response = {'success': True, 'vitrine': vitrine[0]}
-            else:
-                response = {'success': False, 'message': 'Vitrine não encontrada'}
-        
-        # Produtos de uma vitrine
-        elif '/api/produtos' in path:
-            vitrine_id = path.split('vitrine_id=')[-1] if 'vitrine_id=' in path else None
-            if vitrine_id:
-                produtos = supabase_request(f'produtos?vitrine_id=eq.{vitrine_id}&select=*')
-                response = {'success': True, 'produtos': produtos if isinstance(produtos, list) else []}
-            else:
-                response = {'success': False, 'message': 'vitrine_id necessário'}
-        
-        # Usuário por ID
-        elif '/api/user/' in path:
-            user_id = path.split('/api/user/')[-1].split('?')[0]
-            users = supabase_request(f'users?id=eq.{user_id}&select=id,name,email,phone')
-            if users and isinstance(users, list) and len(users) > 0:
-                response = {'success': True, 'user': users[0]}
-            else:
-                response = {'success': False, 'message': 'Usuário não encontrado'}
-        
-        else:
-            response = {'success': False, 'message': 'Endpoint não encontrado'}
+        buffer = bytearray() if ndjson else bytearray(b'{"success":true,"' + key.encode() + b'":[')
+        first = True
+        try:
+            for item in items:
+                if ndjson:
+                    buffer += dumps(loads(item)) + b'\n'
+                else:
+                    if not first:
+                        buffer += b','
+                    buffer += item
+                first = False
+                if len(buffer) >= STREAM_CHUNK_SIZE:
+                    self.wfile.write(buffer)
+                    buffer = bytearray()
+        except Exception as e:
+            # Status 200 já foi enviado: fecha a conexão sem "]...}" para o
+            # cliente ver um corpo inválido em vez de uma lista (e versão) incompleta
+            self.log_error('Listagem %s interrompida: %s', key, e)
+            self.close_connection = True
+            return
+        if not ndjson:
+            # Campos extras entram depois do array: {"success":true,"x":[...],"version":N}
+            buffer += b'],' + dumps(extra)[1:] if extra else b']}'
+        self.wfile.write(buffer)
+    
+    def respond(self, method, data=None):
+        parts = urlsplit(self.path)
+        if parts.path.startswith('/api/admin/'):
+            token = self.headers.get('X-Admin-Token') or ''
+            if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+                return self.send_json({'success': False, 'message': 'Endpoint não encontrado'})
         
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+        # Profiling sob demanda: header X-Profile ou ?__profile= com PROFILE_SECRET
+        token = self.headers.get('X-Profile') or parse_qs(parts.query).get('__profile', [''])[-1]
+        active = profiler.begin(method, parts.path, forced=profiler.is_authorized(token))
+        try:
+            result = dispatch(method, self.path, data)
+            if isinstance(result, Listing):
+                return self.send_listing(result)
+            self.send_json(result)
+        finally:
+            profiler.end(active, 200)
+    
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_cors_headers()
+        self.end_headers()
+    
+    def do_GET(self):
+        self.respond('GET')
     
     def do_POST(self):
         content_length = int(self.headers.get('Content-Length', 0))
@@ -111,132 +744,7 @@ class handler(BaseHTTPRequestHandler):
         except:
             data = {}
         
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_cors_headers()
-        self.end_headers()
-        
-        path = self.path
-        
-        # Cadastro
-        if path == '/api/auth/register':
-            # Verificar se email já existe
-            existing = supabase_request(f"users?email=eq.{data.get('email')}&select=id")
-            if existing and isinstance(existing, list) and len(existing) > 0:
-                response = {'success': False, 'message': 'Email já cadastrado'}
-            else:
-                user_data = {
-                    'name': data.get('name'),
-                    'email': data.get('email'),
-                    'password_hash': hash_password(data.get('password', '')),
-                    'phone': data.get('phone', ''),
-                    'role': 'user',
-                    'status': 'active'
-                }
-                result = supabase_request('users', 'POST', user_data)
-                if 'error' in result:
-                    response = {'success': False, 'message': str(result['error'])}
-                else:
-                    user = result[0] if isinstance(result, list) else result
-                    response = {
-                        'success': True,
-                        'message': 'Usuário cadastrado com sucesso!',
-                        'user': {'id': user.get('id'), 'name': user.get('name'), 'email': user.get('email')}
-                    }
-        
-        # Login
-        elif path == '/api/auth/login':
-            email = data.get('email')
-            password_hash = hash_password(data.get('password', ''))
-            users = supabase_request(f'users?email=eq.{email}&password_hash=eq.{password_hash}&select=*')
-            
-            if users and isinstance(users, list) and len(users) > 0:
-                user = users[0]
-                response = {
-                    'success': True,
-                    'message': 'Login realizado com sucesso!',
-                    'user': {
-                        'id': user['id'],
-                        'name': user['name'],
-                        'email': user['email'],
-                        'phone': user.get('phone', '')
-                    }
-                }
-            else:
-                response = {'success': False, 'message': 'Email ou senha incorretos'}
-        
-        # Criar/Atualizar vitrine
-        elif path == '/api/vitrines':
-            vitrine_data = {
-                'user_id': data.get('user_id'),
-                'name': data.get('name'),
-                'slug': data.get('slug'),
-                'description': data.get('description', ''),
-                'whatsapp': data.get('whatsapp', ''),
-                'instagram': data.get('instagram', ''),
-                'address': data.get('address', ''),
-                'city': data.get('city', ''),
-                'state': data.get('state', ''),
-                'is_active': data.get('is_active', True)
-            }
-            
-            # Verificar se já existe vitrine para este usuário
-            existing = supabase_request(f"vitrines?user_id=eq.{data.get('user_id')}&select=id")
-            
-            if existing and isinstance(existing, list) and len(existing) > 0:
-                # Atualizar
-                vitrine_id = existing[0]['id']
-                result = supabase_request(f'vitrines?id=eq.{vitrine_id}', 'PATCH', vitrine_data)
-            else:
-                # Criar
-                result = supabase_request('vitrines', 'POST', vitrine_data)
-            
-            if 'error' in result:
-                response = {'success': False, 'message': str(result['error'])}
-            else:
-                vitrine = result[0] if isinstance(result, list) else result
-                response = {'success': True, 'message': 'Vitrine salva!', 'vitrine': vitrine}
-        
-        # Criar produto
-        elif path == '/api/produtos':
-            produto_data = {
-                'vitrine_id': data.get('vitrine_id'),
-                'name': data.get('name'),
-                'description': data.get('description', ''),
-                'price': data.get('price'),
-                'year': data.get('year'),
-                'km': data.get('km'),
-                'color': data.get('color', ''),
-                'image_url': data.get('image_url', ''),
-                'images': data.get('images', ''),
-                'is_active': True
-            }
-            result = supabase_request('produtos', 'POST', produto_data)
-            if 'error' in result:
-                response = {'success': False, 'message': str(result['error'])}
-            else:
-                produto = result[0] if isinstance(result, list) else result
-                response = {'success': True, 'message': 'Produto adicionado!', 'produto': produto}
-        
-        else:
-            response = {'success': False, 'message': 'Endpoint não encontrado'}
-        
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+        self.respond('POST', data if isinstance(data, dict) else {})
     
     def do_DELETE(self):
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_cors_headers()
-        self.end_headers()
-        
-        path = self.path
-        
-        # Deletar produto
-        if '/api/produtos/' in path:
-            produto_id = path.split('/api/produtos/')[-1]
-            result = supabase_request(f'produtos?id=eq.{produto_id}', 'DELETE')
-            response = {'success': True, 'message': 'Produto removido!'}
-        else:
-            response = {'success': False, 'message': 'Endpoint não encontrado'}
-        
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+        self.respond('DELETE')
@@ -2,11 +2,21 @@ import logging
 import os
 import traceback
 
-from flask import Flask, jsonify, redirect, request, send_from_directory
+from flask import Flask, g, jsonify, redirect, request, send_from_directory
 from flask_cors import CORS
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from catalog_snapshot import catalog
+from controllers.batch_controller import batch_bp
+from controllers.dashboard_controller import dashboard_bp
+from controllers.metrics_controller import metrics_bp
+from controllers.moto_controller import moto_bp
+from controllers.outbox_controller import outbox_bp
+from controllers.vitrine_controller import vitrine_bp, vitrine_service
 from database_api import GoogleSheetsDB
+from outbox import IdempotencyKeyReused, outbox
+from profiling import profiler
+from rate_limit import UpstreamSaturated, limiter, rate_limited, upstream_gate
 
 
 BASE_DIR = os.path.dirname(__file__)
@@ -23,7 +33,8 @@ CORS(
     resources={r"/*": {"origins": ALLOWED_ORIGINS}},
     supports_credentials=False,
     methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "Idempotency-Key", "X-Profile"],
+    expose_headers=["X-Sync-Version"],
 )
 
 API_URL = os.getenv(
@@ -31,9 +42,29 @@ API_URL = os.getenv(
     "https://script.google.com/macros/s/AKfycbxXm7cKe12c9KuN790jIhrqTDKEUfsxwb_vzcgJHt71NhJduP8qod70SnK3FZ5VjBpK/exec",
 )
 gsheets = GoogleSheetsDB(API_URL)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+app.register_blueprint(vitrine_bp)
+app.register_blueprint(moto_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(dashboard_bp)
+app.register_blueprint(outbox_bp)
+app.register_blueprint(batch_bp)
+
+# Com gunicorn --preload o master publica o snapshot (vitrines conhecidas +
+# CATALOG_WARM_SLUGS) antes do fork, entao workers novos ja nascem aquecidos.
+# Sem --preload o primeiro worker publica e os demais acham o snapshot fresco.
+catalog.open()
+if not catalog.is_fresh():
+    try:
+        warm_slugs = [slug.strip() for slug in os.getenv("CATALOG_WARM_SLUGS", "").split(",") if slug.strip()]
+        app.logger.info("Catalog snapshot warmed with %s vitrine(s)", vitrine_service.aquecer_catalogo(warm_slugs))
+    except Exception:
+        app.logger.exception("Falha ao aquecer o snapshot do catalogo")
 
 app.logger.info("Flask API starting")
 app.logger.info("Google Sheets endpoint: %s", API_URL)
+app.logger.info("Catalog snapshot: %s (generation %s)", catalog.path, catalog.generation)
 
 
 def is_api_path(path: str) -> bool:
@@ -60,6 +91,10 @@ def wants_json_response():
     return "application/json" in accept or "text/javascript" in accept
 
 
+def is_admin_request():
+    return bool(ADMIN_TOKEN) and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+
 def no_cache(response):
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
@@ -76,23 +111,67 @@ def request_log():
         request.headers.get("Origin"),
         request.headers.get("Content-Type"),
     )
+    outbox.ensure_worker()
+
+
+@app.before_request
+def begin_profile():
+    # Profiling sob demanda: header X-Profile ou ?__profile= com PROFILE_SECRET
+    token = request.headers.get("X-Profile") or request.args.get("__profile")
+    g.profile = profiler.begin(request.method, request.path, forced=profiler.is_authorized(token))
 
 
 @app.after_request
 def after_request(response):
+    g.response_status = response.status_code
     return no_cache(response)
 
 
+@app.teardown_request
+def end_profile(error):
+    profile_id = profiler.end(g.pop("profile", None), g.pop("response_status", 500 if error else None))
+    if profile_id:
+        app.logger.info("Profile saved id=%s path=%s", profile_id, request.path)
+
+
 @app.route("/health", methods=["GET"])
 @app.route("/api/health", methods=["GET"])
 def health():
     return jsonify({"status": "ok"}), 200
 
 
+@app.route("/api/admin/limits", methods=["GET"])
+def admin_limits():
+    if not is_admin_request():
+        return jsonify({"error": "Not Found", "path": request.path}), 404
+    return jsonify({"rate_limits": limiter.stats(), "upstream": upstream_gate.stats()}), 200
+
+
+@app.route("/api/admin/profiles", methods=["GET"])
+def admin_profiles():
+    if not is_admin_request():
+        return jsonify({"error": "Not Found", "path": request.path}), 404
+    return jsonify({"profiles": profiler.list_profiles()}), 200
+
+
+@app.route("/api/admin/profiles/<profile_id>", methods=["GET"])
+def admin_profile(profile_id):
+    if not is_admin_request():
+        return jsonify({"error": "Not Found", "path": request.path}), 404
+    profile = profiler.load(profile_id)
+    if profile is None:
+        return jsonify({"error": "Not Found", "path": request.path}), 404
+    if request.args.get("format") == "collapsed":
+        # Direto para flamegraph.pl / speedscope
+        return app.response_class(profile["stacks"], mimetype="text/plain")
+    return jsonify(profile), 200
+
+
 @app.route("/login", methods=["GET", "POST", "OPTIONS"])
 @app.route("/auth/login", methods=["GET", "POST", "OPTIONS"])
 @app.route("/api/auth/login", methods=["GET", "POST", "OPTIONS"])
 @app.route("/api/v1/auth/login", methods=["GET", "POST", "OPTIONS"])
+@rate_limited("login")
 def login():
     if request.method == "GET":
         return send_from_directory(FRONTEND_DIR, "login.html")
@@ -134,6 +213,8 @@ def login():
             ),
             401,
         )
+    except UpstreamSaturated:
+        raise
     except Exception as exc:
         app.logger.exception("Erro no login")
         return jsonify({"success": False, "message": str(exc), "trace": traceback.format_exc()}), 500
@@ -146,6 +227,7 @@ def login():
 @app.route("/api/auth/register", methods=["GET", "POST", "OPTIONS"])
 @app.route("/api/v1/register", methods=["GET", "POST", "OPTIONS"])
 @app.route("/api/v1/auth/register", methods=["GET", "POST", "OPTIONS"])
+@rate_limited("register")
 def register():
     if request.method == "GET":
         return send_from_directory(FRONTEND_DIR, "cadastro.html")
@@ -164,15 +246,19 @@ def register():
         if missing:
             return jsonify({"status": "erro", "msg": f"Campos obrigatorios ausentes: {', '.join(missing)}"}), 400
 
-        resposta = gsheets.send_request(
-            {
-                "acao": "criar_usuario",
-                "nome": nome,
-                "email": email,
-                "senha": senha,
-                "telefone": telefone,
-            }
-        )
+        payload = {
+            "acao": "criar_usuario",
+            "nome": nome,
+            "email": email,
+            "senha": senha,
+            "telefone": telefone,
+        }
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if idempotency_key:
+            # Gravado no outbox local; o status sai em /api/outbox/<chave>
+            return jsonify(outbox.enqueue(idempotency_key, payload)), 202
+
+        resposta = gsheets.send_request(payload)
 
         status_code = 201 if resposta.get("status") == "ok" else 400
         if wants_json_response():
@@ -180,12 +266,15 @@ def register():
         if status_code == 201:
             return redirect("/login.html?cadastro=ok", code=302)
         return jsonify(resposta), status_code
+    except (UpstreamSaturated, IdempotencyKeyReused):
+        raise
     except Exception as exc:
         app.logger.exception("Erro no register")
         return jsonify({"erro": str(exc), "trace": traceback.format_exc()}), 500
 
 
 @app.route("/teste-sheets", methods=["GET"])
+@rate_limited("teste_sheets", methods=("GET",))
 def teste_sheets():
     payload = {
         "acao": "criar_usuario",
@@ -198,6 +287,21 @@ def teste_sheets():
     return jsonify(resposta), 200
 
 
+@app.errorhandler(UpstreamSaturated)
+def upstream_saturated(error):
+    app.logger.warning("503 upstream saturated path=%s reason=%s", request.path, error)
+    response = jsonify({"ok": False, "error": "Servico temporariamente sobrecarregado, tente novamente"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@app.errorhandler(IdempotencyKeyReused)
+def idempotency_key_reused(error):
+    app.logger.warning("422 idempotency key reused path=%s key=%s", request.path, error)
+    return jsonify({"ok": False, "error": "Idempotency-Key já usada para outra operação"}), 422
+
+
 @app.errorhandler(404)
 def not_found(error):
     if is_api_path(request.path):
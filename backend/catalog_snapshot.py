@@ -0,0 +1,391 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows (setup.bat): sem lock entre processos
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# Cabecalho: magic, versao do formato, geracao, quantidade de vitrines, publicado_em
+HEADER = struct.Struct("<4sIQId")
+# Indice ordenado pelo hash do slug: hash, offset, tamanho, gravado_em
+SLOT = struct.Struct("<QQId")
+SLOT_HASH = struct.Struct("<Q")
+MAGIC = b"VCAT"
+FORMAT_VERSION = 2
+
+# Galeria (base64 pesado): o card leva so a capa, imagens[0], e a contagem
+GALLERY_FIELDS = ("imagens", "images")
+
+
+def _gallery(value):
+    if isinstance(value, str) and value.lstrip().startswith("["):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    return value if isinstance(value, list) else None
+
+
+def card_fields(moto):
+    if not isinstance(moto, dict):
+        return moto
+    card = dict(moto)
+    for field in GALLERY_FIELDS:
+        gallery = _gallery(card.get(field))
+        if gallery is not None:
+            card[field] = gallery[:1]
+            card["total_imagens"] = len(gallery)
+    return card
+
+
+def slug_hash(slug):
+    return int.from_bytes(hashlib.blake2b(str(slug).encode(), digest_size=8).digest(), "little")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _blob(slug, vitrine, motos):
+    return _dumps({"slug": slug, "vitrine": vitrine, "motos": [card_fields(moto) for moto in motos or []]})
+
+
+def _discard_keys(record):
+    for kind in ("slug", "vitrine_id", "moto_id"):
+        if record.get(kind) is not None:
+            yield kind, str(record[kind])
+
+
+class CatalogSnapshot:
+    """Imagem compacta das vitrines ativas compartilhada entre os workers.
+
+    O snapshot e mapeado em memoria (mmap), entao todos os workers do gunicorn
+    leem as mesmas paginas do page cache. Ele e publicado inteiro (no preload,
+    com as vitrines conhecidas) com a geracao incrementada e trocado com
+    os.replace; os leitores percebem a troca pelo inode e remapeiam.
+
+    Layout: HEADER | SLOTs ordenados por hash do slug | blobs JSON. A busca e
+    binaria direto no mmap, sem indice carregado por worker.
+
+    Escritas entre publicacoes (vitrine buscada num cache miss, invalidacao
+    apos editar uma moto) sao linhas acrescentadas a ``<path>.journal``, entao
+    custam o tamanho do registro e nao o do catalogo. Uma invalidacao vale para
+    entradas buscadas antes dela. Passando de ``journal_max`` bytes o journal
+    e compactado num snapshot novo.
+    """
+
+    def __init__(self, path, ttl=300, journal_max=4 * 1024 * 1024):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.ttl = ttl
+        self.journal_max = journal_max
+        self._lock = threading.Lock()
+        self._map = None
+        self._inode = None
+        self._generation = 0
+        self._count = 0
+        self._published_at = 0.0
+        self._journal_map = None
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._overlay = {}   # slug -> (offset, tamanho, gravado_em) no journal
+        self._discards = {}  # (tipo, valor) -> momento da invalidacao mais recente
+
+    @property
+    def generation(self):
+        self._refresh()
+        return self._generation
+
+    def open(self):
+        self._refresh()
+        return self
+
+    def is_fresh(self):
+        self._refresh()
+        return bool(self._published_at) and (not self.ttl or time.time() - self._published_at <= self.ttl)
+
+    def get(self, slug):
+        with self._lock:
+            self._refresh_locked()
+            located = self._locate_locked(slug)
+        if located is None:
+            return None
+        mapped, offset, length, stored_at = located
+        if self._expired(stored_at):
+            return None
+        # So o blob desta vitrine e copiado e decodificado, fora do lock
+        entry = json.loads(mapped[offset:offset + length])
+        with self._lock:
+            if entry.get("slug") != slug or self._is_discarded_locked(entry, stored_at):
+                return None
+        return entry
+
+    def entries(self, include_expired=False):
+        """Todas as vitrines validas (snapshot + journal), ja decodificadas."""
+        return [entry for _blob, _stored_at, entry in self._collect(include_expired).values()]
+
+    def put(self, slug, vitrine, motos, fetched_at=None):
+        meta = _dumps({"op": "put", "ts": fetched_at or time.time(), "slug": slug})
+        self._append(meta + b"\t" + _blob(slug, vitrine, motos) + b"\n")
+
+    def discard(self, slug=None, vitrine_id=None, moto_id=None):
+        record = {"op": "discard", "ts": time.time(), "slug": slug, "vitrine_id": vitrine_id, "moto_id": moto_id}
+        self._append(_dumps({key: value for key, value in record.items() if value is not None}) + b"\n")
+
+    def publish(self, catalog, fetched_at=None):
+        """Substitui a imagem inteira; ``catalog`` e {slug: (vitrine, motos)}.
+
+        Registros do journal a partir de ``fetched_at`` (inicio da busca)
+        continuam valendo sobre a imagem nova.
+        """
+        fetched_at = fetched_at or time.time()
+        entries = {slug: (_blob(slug, vitrine, motos), fetched_at) for slug, (vitrine, motos) in catalog.items()}
+        with self._file_lock():
+            self._write_snapshot(entries, keep_since=fetched_at)
+
+    ############################
+    # LEITURA
+    ############################
+    def _expired(self, stored_at, now=None):
+        return bool(self.ttl) and (now or time.time()) - stored_at > self.ttl
+
+    def _locate_locked(self, slug):
+        found = None
+        if self._map is not None and self._count:
+            target = slug_hash(slug)
+            low, high = 0, self._count
+            while low < high:
+                middle = (low + high) // 2
+                if SLOT_HASH.unpack_from(self._map, HEADER.size + middle * SLOT.size)[0] < target:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < self._count:
+                hashed, offset, length, stored_at = SLOT.unpack_from(self._map, HEADER.size + low * SLOT.size)
+                if hashed == target:
+                    found = (self._map, offset, length, stored_at)
+        overlay = self._overlay.get(slug)
+        if overlay is not None and (found is None or overlay[2] >= found[3]):
+            found = (self._journal_map, *overlay)
+        return found
+
+    def _is_discarded_locked(self, entry, stored_at):
+        if not self._discards:
+            return False
+        vitrine = entry.get("vitrine") if isinstance(entry.get("vitrine"), dict) else {}
+        keys = [("slug", str(entry.get("slug"))), ("vitrine_id", str(vitrine.get("id")))]
+        keys += [("moto_id", str(moto.get("id"))) for moto in entry.get("motos") or [] if isinstance(moto, dict)]
+        return any(self._discards.get(key, -1.0) >= stored_at for key in keys)
+
+    def _collect(self, include_expired=False):
+        with self._lock:
+            self._refresh_locked()
+            sources = []
+            if self._map is not None:
+                for position in range(self._count):
+                    _hash, offset, length, stored_at = SLOT.unpack_from(self._map, HEADER.size + position * SLOT.size)
+                    sources.append((self._map, offset, length, stored_at))
+            sources.extend((self._journal_map, *overlay) for overlay in self._overlay.values())
+
+        now = time.time()
+        collected = {}
+        for mapped, offset, length, stored_at in sources:
+            if not include_expired and self._expired(stored_at, now):
+                continue
+            blob = mapped[offset:offset + length]
+            entry = json.loads(blob)
+            slug = entry.get("slug")
+            if slug not in collected or collected[slug][1] < stored_at:
+                collected[slug] = (blob, stored_at, entry)
+        with self._lock:
+            return {
+                slug: value for slug, value in collected.items()
+                if not self._is_discarded_locked(value[2], value[1])
+            }
+
+    def _refresh(self):
+        with self._lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        self._refresh_snapshot_locked()
+        self._refresh_journal_locked()
+
+    def _refresh_snapshot_locked(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            self._map, self._inode, self._count, self._published_at = None, None, 0, 0.0
+            return
+        if inode == self._inode:
+            return
+
+        # Mapas antigos nao sao fechados: leituras em andamento ainda os usam
+        self._map, self._inode, self._count, self._published_at = None, inode, 0, 0.0
+        try:
+            with open(self.path, "rb") as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                self._inode = os.fstat(handle.fileno()).st_ino
+        except (OSError, ValueError):
+            logger.warning("Snapshot do catalogo indisponivel em %s", self.path)
+            return
+
+        if len(mapped) < HEADER.size:
+            return
+        magic, version, generation, count, published_at = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            logger.warning("Snapshot do catalogo ignorado: formato invalido em %s", self.path)
+            return
+        self._map = mapped
+        self._generation = generation
+        self._count = count
+        self._published_at = published_at
+
+    def _refresh_journal_locked(self):
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            stat = None
+        inode = stat.st_ino if stat else None
+        if inode != self._journal_inode:
+            self._journal_inode = inode
+            self._journal_map = None
+            self._journal_offset = 0
+            self._overlay = {}
+            self._discards = {}
+        if stat is None or stat.st_size <= self._journal_offset:
+            return
+
+        try:
+            with open(self.journal_path, "rb") as handle:
+                if os.fstat(handle.fileno()).st_ino != inode:
+                    return  # trocado no meio; a proxima leitura pega o novo
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            logger.warning("Journal do catalogo indisponivel em %s", self.journal_path)
+            return
+
+        tail = mapped[self._journal_offset:]
+        end = tail.rfind(b"\n") + 1
+        position = self._journal_offset
+        for line in tail[:end].split(b"\n")[:-1]:
+            self._apply_locked(line, position)
+            position += len(line) + 1
+        self._journal_map = mapped
+        self._journal_offset += end
+
+    def _apply_locked(self, line, position):
+        meta, tab, blob = line.partition(b"\t")
+        try:
+            record = json.loads(meta)
+        except ValueError:
+            return
+        if record.get("op") == "put" and tab:
+            self._overlay[record["slug"]] = (position + len(meta) + 1, len(blob), record["ts"])
+        elif record.get("op") == "discard":
+            for key in _discard_keys(record):
+                self._discards[key] = max(self._discards.get(key, 0.0), record["ts"])
+
+    ############################
+    # ESCRITA
+    ############################
+    @contextmanager
+    def _file_lock(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, record):
+        with self._file_lock():
+            with open(self.journal_path, "ab") as handle:
+                handle.write(record)
+                size = handle.tell()
+            if self.journal_max and size > self.journal_max:
+                entries = {slug: (blob, stored_at) for slug, (blob, stored_at, _entry) in self._collect(True).items()}
+                self._write_snapshot(entries, keep_since=None)
+
+    def _write_snapshot(self, entries, keep_since):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        ordered = sorted(((slug_hash(slug), blob, stored_at) for slug, (blob, stored_at) in entries.items()),
+                         key=lambda item: item[0])
+
+        position = HEADER.size + SLOT.size * len(ordered)
+        slots = []
+        for hashed, blob, stored_at in ordered:
+            slots.append(SLOT.pack(hashed, position, len(blob), stored_at))
+            position += len(blob)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, self._stored_generation() + 1, len(ordered), time.time()))
+                handle.writelines(slots)
+                handle.writelines(blob for _hash, blob, _stored_at in ordered)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._rewrite_journal(directory, keep_since)
+
+    def _rewrite_journal(self, directory, keep_since):
+        kept = []
+        if keep_since is not None:
+            try:
+                with open(self.journal_path, "rb") as handle:
+                    lines = handle.read().split(b"\n")[:-1]
+            except FileNotFoundError:
+                lines = []
+            for line in lines:
+                try:
+                    if json.loads(line.partition(b"\t")[0]).get("ts", 0) >= keep_since:
+                        kept.append(line + b"\n")
+                except ValueError:
+                    continue
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".catalog-journal-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.writelines(kept)
+            os.replace(tmp_path, self.journal_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _stored_generation(self):
+        try:
+            with open(self.path, "rb") as handle:
+                header = handle.read(HEADER.size)
+        except FileNotFoundError:
+            return 0
+        if len(header) < HEADER.size:
+            return 0
+        magic, version, generation, _count, _published_at = HEADER.unpack(header)
+        return generation if magic == MAGIC and version == FORMAT_VERSION else 0
+
+
+catalog = CatalogSnapshot(
+    os.getenv("CATALOG_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "vitrine_catalog.snap")),
+    ttl=int(os.getenv("CATALOG_SNAPSHOT_TTL", "300")),
+    journal_max=int(os.getenv("CATALOG_JOURNAL_MAX", str(4 * 1024 * 1024))),
+)
@@ -0,0 +1,96 @@
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, current_app, jsonify, request
+from database_api import RequestMemo, request_memo
+
+batch_bp = Blueprint('batch', __name__)
+
+MAX_BATCH_SIZE = int(os.getenv('BATCH_MAX_SIZE', '20'))
+MAX_BATCH_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+
+# Headers do cliente repassados para cada sub-requisicao
+FORWARDED_HEADERS = ('Authorization', 'Idempotency-Key')
+READ_METHODS = ('GET', 'HEAD')
+
+
+def batch_waves(subrequests):
+    """Agrupa ``[(posicao, sub)]`` em ondas, na ordem de envio.
+
+    Leituras consecutivas sao independentes e formam uma onda paralela; cada
+    escrita e uma onda sozinha, entao leituras depois dela veem o dado novo.
+    """
+    wave = []
+    for position, sub in subrequests:
+        if (sub.get('method') or 'GET').upper() in READ_METHODS:
+            wave.append((position, sub))
+            continue
+        if wave:
+            yield wave
+            wave = []
+        yield [(position, sub)]
+    if wave:
+        yield wave
+
+
+def run_subrequest(app, sub, remote_addr):
+    method = (sub.get('method') or 'GET').upper()
+    path = sub.get('path') or ''
+    if not path.startswith('/') or path.split('?')[0].rstrip('/') == '/api/batch':
+        return {"id": sub.get('id'), "status": 400, "body": {"ok": False, "error": "path inválido"}}
+
+    sub_headers = sub.get('headers') if isinstance(sub.get('headers'), dict) else {}
+    headers = {name: sub_headers[name] for name in FORWARDED_HEADERS if name in sub_headers}
+    headers['Accept'] = 'application/json'
+    with app.test_request_context(
+        path,
+        method=method,
+        json=sub.get('body'),
+        headers=headers,
+        environ_base={'REMOTE_ADDR': remote_addr},
+    ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as exc:
+            response = app.make_response(app.handle_exception(exc))
+
+    raw = response.get_data()
+    try:
+        body = json.loads(raw) if raw else None
+    except ValueError:
+        body = raw.decode('utf-8', 'replace')
+    return {"id": sub.get('id'), "status": response.status_code, "body": body}
+
+
+@batch_bp.route('/api/batch', methods=['POST'])
+def batch():
+    data = request.get_json(silent=True) or {}
+    subrequests = data.get('requests')
+    if not isinstance(subrequests, list) or not all(isinstance(sub, dict) for sub in subrequests):
+        return jsonify({"ok": False, "error": "Envie {\"requests\": [{\"method\", \"path\", \"body\"}]}"}), 400
+    if len(subrequests) > MAX_BATCH_SIZE:
+        return jsonify({"ok": False, "error": f"Máximo de {MAX_BATCH_SIZE} sub-requisições por lote"}), 400
+
+    app = current_app._get_current_object()
+    remote_addr = request.remote_addr
+
+    responses = [None] * len(subrequests)
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_BATCH_WORKERS, len(subrequests)))) as executor:
+        for wave in batch_waves(enumerate(subrequests)):
+            # Leituras da mesma onda compartilham o memo: a mesma vitrine e
+            # buscada uma vez. Memo novo por onda para nao servir dado de antes
+            # de uma escrita.
+            token = request_memo.set(RequestMemo())
+            try:
+                futures = [
+                    (position, executor.submit(contextvars.copy_context().run, run_subrequest, app, sub, remote_addr))
+                    for position, sub in wave
+                ]
+                for position, future in futures:
+                    responses[position] = future.result()
+            finally:
+                request_memo.reset(token)
+
+    return jsonify({"ok": True, "responses": responses}), 200
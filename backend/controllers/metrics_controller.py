@@ -1,16 +1,19 @@
 from flask import Blueprint, request, jsonify
 from services.metrics_service import MetricsService
+from rate_limit import rate_limited
 
 metrics_bp = Blueprint('metrics', __name__)
 metrics_service = MetricsService()
 
 @metrics_bp.route('/metrics/view', methods=['POST'])
+@rate_limited('metrics_view')
 def somar_view():
     data = request.get_json()
     result = metrics_service.somar_view(data)
     return jsonify(result), 200 if result.get('ok') else 400
 
 @metrics_bp.route('/metrics/lead', methods=['POST'])
+@rate_limited('metrics_lead')
 def salvar_lead():
     data = request.get_json()
     result = metrics_service.salvar_lead(data)
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from services.moto_service import MotoService
+from json_stream import stream_listing
 
 moto_bp = Blueprint('moto', __name__)
 moto_service = MotoService()
@@ -7,22 +8,38 @@ moto_service = MotoService()
 @moto_bp.route('/motos', methods=['POST'])
 def criar_moto():
     data = request.get_json()
-    result = moto_service.criar_moto(data)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    result = moto_service.criar_moto(data, idempotency_key)
+    if idempotency_key:
+        return jsonify(result), 202
     return jsonify(result), 201 if result.get('ok') else 400
 
 @moto_bp.route('/motos/<int:moto_id>', methods=['PUT'])
 def editar_moto(moto_id):
     data = request.get_json()
-    result = moto_service.editar_moto(moto_id, data)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    result = moto_service.editar_moto(moto_id, data, idempotency_key)
+    if idempotency_key:
+        return jsonify(result), 202
     return jsonify(result), 200 if result.get('ok') else 400
 
 @moto_bp.route('/motos/<int:moto_id>', methods=['DELETE'])
 def excluir_moto(moto_id):
-    result = moto_service.excluir_moto(moto_id)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    result = moto_service.excluir_moto(moto_id, request.args.get('vitrine_id'), idempotency_key)
+    if idempotency_key:
+        return jsonify(result), 202
     return jsonify(result), 200 if result.get('ok') else 400
 
 @moto_bp.route('/motos', methods=['GET'])
 def listar_motos():
     vitrine_id = request.args.get('vitrine_id')
-    result = moto_service.listar_motos(vitrine_id)
-    return jsonify(result), 200 if result.get('ok') else 400
+    result = moto_service.listar_motos(vitrine_id, request.args.get('since', type=int))
+    if result.get('full') is False:
+        # Delta e pequeno e precisa da lista "deleted": vai sempre como JSON
+        return jsonify(result), 200
+    response = stream_listing(result, 200 if result.get('ok') else 400)
+    if 'version' in result:
+        # NDJSON nao tem envelope; a versao segue tambem em header
+        response.headers['X-Sync-Version'] = str(result['version'])
+    return response
@@ -0,0 +1,11 @@
+from flask import Blueprint, jsonify
+from outbox import outbox
+
+outbox_bp = Blueprint('outbox', __name__)
+
+@outbox_bp.route('/api/outbox/<idempotency_key>', methods=['GET'])
+def get_status(idempotency_key):
+    result = outbox.status(idempotency_key)
+    if result is None:
+        return jsonify({"ok": False, "error": "Idempotency-Key não encontrada"}), 404
+    return jsonify(result), 200
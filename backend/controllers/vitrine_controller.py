@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from services.vitrine_service import VitrineService
+from json_stream import stream_listing
 
 vitrine_bp = Blueprint('vitrine', __name__)
 vitrine_service = VitrineService()
@@ -12,4 +13,11 @@ def get_vitrine(slug):
 @vitrine_bp.route('/vitrine/<slug>/motos', methods=['GET'])
 def get_motos_by_vitrine(slug):
     result = vitrine_service.get_motos_by_vitrine(slug)
+    return stream_listing(result, 200 if result.get('ok') else 404)
+
+@vitrine_bp.route('/vitrine/<slug>/motos/<moto_id>/similares', methods=['GET'])
+def get_similares(slug, moto_id):
+    k = min(max(request.args.get('k', 6, type=int), 1), 24)
+    escopo = 'cidade' if request.args.get('escopo') == 'cidade' else 'vitrine'
+    result = vitrine_service.get_similares(slug, moto_id, k, escopo)
     return jsonify(result), 200 if result.get('ok') else 404
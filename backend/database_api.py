@@ -1,5 +1,69 @@
 import requests
 import json
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import ContextVar
+
+from urllib3.exceptions import NewConnectionError
+
+from profiling import record_upstream
+from rate_limit import upstream_gate
+
+
+# Leituras que podem ser compartilhadas dentro de uma mesma requisicao
+READ_ACTIONS = {"buscar_vitrine", "listar_motos", "dashboard"}
+
+
+class RequestMemo:
+    """Memo de leituras com escopo de requisicao (usado pelo /api/batch).
+
+    Sub-requisicoes concorrentes que pedem a mesma leitura esperam a primeira
+    chamada em vez de repetir a ida ao Apps Script.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def get_or_call(self, key, call):
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+        if owner:
+            try:
+                future.set_result(call())
+            except BaseException as exc:
+                future.set_exception(exc)
+        return future.result()
+
+
+request_memo = ContextVar("request_memo", default=None)
+
+
+def request_sent(exc):
+    """False so quando a falha foi antes do pedido chegar ao Apps Script.
+
+    Timeout de leitura ou conexao caida no meio da resposta sao ambiguos: a
+    escrita pode ter sido aplicada.
+    """
+    if isinstance(exc, requests.ConnectTimeout):
+        return False
+    if isinstance(exc, requests.ConnectionError):
+        reason = getattr(exc.args[0], "reason", None) if exc.args else None
+        return not isinstance(reason, NewConnectionError)
+    return True
+
+
+def memo_key(payload):
+    # vitrine_id chega como 7 ou "7" conforme a rota; o Apps Script trata igual
+    normalized = {
+        key: str(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+        for key, value in payload.items()
+    }
+    return json.dumps(normalized, sort_keys=True, default=str)
 
 class GoogleSheetsDB:
 
@@ -7,6 +71,21 @@ class GoogleSheetsDB:
         self.api_url = api_url
 
     def send_request(self, payload):
+        memo = request_memo.get()
+        if memo is not None and payload.get("acao") in READ_ACTIONS:
+            key = (self.api_url, memo_key(payload))
+            return memo.get_or_call(key, lambda: self._gated_post(payload))
+        return self._gated_post(payload)
+
+    def _gated_post(self, payload):
+        # UpstreamSaturated sobe para o handler do Flask (503)
+        started = time.perf_counter()
+        with upstream_gate:
+            result = self._post(payload)
+        record_upstream(payload.get("acao"), started, result.get("erro"))
+        return result
+
+    def _post(self, payload):
         headers = {"Content-Type": "application/json"}
 
         print("\n========== ENVIANDO PARA GOOGLE SHEETS ==========")
@@ -38,7 +117,7 @@ class GoogleSheetsDB:
 
         except Exception as e:
             print("ERRO REQUEST:", str(e))
-            return {"erro": str(e)}
+            return {"erro": str(e), "enviado": request_sent(e)}
 
     ############################
     # USUARIO
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vitrine_versions (
+    vitrine_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS moto_versions (
+    vitrine_id TEXT NOT NULL,
+    moto_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    digest TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (vitrine_id, moto_id)
+);
+CREATE INDEX IF NOT EXISTS idx_moto_versions_since ON moto_versions(vitrine_id, version);
+"""
+
+
+def _digest(moto):
+    canonical = json.dumps(moto, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+class InventoryVersions:
+    """Versao monotonica por vitrine e tombstones para o delta-sync de motos.
+
+    O Apps Script nao versiona linhas, entao cada listagem completa e
+    comparada (hash por linha) com o que foi visto antes: linhas novas ou
+    alteradas recebem a proxima versao da vitrine e as que sumiram viram
+    tombstones. Escritas feitas por aqui marcam a linha na hora.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def reconcile(self, vitrine_id, motos):
+        """Retorna ``(versao_atual, {moto_id: versao})`` para a listagem."""
+        vitrine_id = str(vitrine_id)
+        current = {str(moto.get("id")): _digest(moto) for moto in motos if isinstance(moto, dict)}
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._version(conn, vitrine_id)
+                known = {
+                    moto_id: (row_version, digest, deleted)
+                    for moto_id, row_version, digest, deleted in conn.execute(
+                        "SELECT moto_id, version, digest, deleted FROM moto_versions WHERE vitrine_id = ?",
+                        (vitrine_id,),
+                    )
+                }
+                changed = [
+                    moto_id for moto_id, digest in current.items()
+                    if moto_id not in known or known[moto_id][1] != digest or known[moto_id][2]
+                ]
+                gone = [moto_id for moto_id, (_v, _d, deleted) in known.items() if moto_id not in current and not deleted]
+                if changed or gone:
+                    version += 1
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO moto_versions (vitrine_id, moto_id, version, digest, deleted) "
+                        "VALUES (?, ?, ?, ?, 0)",
+                        [(vitrine_id, moto_id, version, current[moto_id]) for moto_id in changed],
+                    )
+                    conn.executemany(
+                        "UPDATE moto_versions SET version = ?, deleted = 1 WHERE vitrine_id = ? AND moto_id = ?",
+                        [(version, vitrine_id, moto_id) for moto_id in gone],
+                    )
+                    self._set_version(conn, vitrine_id, version)
+                stamps = {
+                    moto_id: row_version
+                    for moto_id, row_version in conn.execute(
+                        "SELECT moto_id, version FROM moto_versions WHERE vitrine_id = ? AND deleted = 0",
+                        (vitrine_id,),
+                    )
+                }
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return version, stamps
+
+    def tombstones(self, vitrine_id, since):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT moto_id, version FROM moto_versions WHERE vitrine_id = ? AND deleted = 1 AND version > ? "
+                "ORDER BY version",
+                (str(vitrine_id), since),
+            ).fetchall()
+        return [{"id": moto_id, "version": version} for moto_id, version in rows]
+
+    def mark_deleted(self, moto_id, vitrine_id=None):
+        """Tombstone imediato; sem ``vitrine_id`` procura a vitrine da moto."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                query = "SELECT vitrine_id FROM moto_versions WHERE moto_id = ? AND deleted = 0"
+                params = [str(moto_id)]
+                if vitrine_id is not None:
+                    query += " AND vitrine_id = ?"
+                    params.append(str(vitrine_id))
+                for (owner,) in conn.execute(query, params).fetchall():
+                    version = self._version(conn, owner) + 1
+                    conn.execute(
+                        "UPDATE moto_versions SET version = ?, deleted = 1 WHERE vitrine_id = ? AND moto_id = ?",
+                        (version, owner, str(moto_id)),
+                    )
+                    self._set_version(conn, owner, version)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _version(conn, vitrine_id):
+        row = conn.execute("SELECT version FROM vitrine_versions WHERE vitrine_id = ?", (vitrine_id,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_version(conn, vitrine_id, version):
+        conn.execute("INSERT OR REPLACE INTO vitrine_versions (vitrine_id, version) VALUES (?, ?)", (vitrine_id, version))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+
+inventory_versions = InventoryVersions(
+    os.getenv("INVENTORY_VERSIONS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "inventory.sqlite3"))
+)
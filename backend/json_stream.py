@@ -0,0 +1,75 @@
+import json
+
+from flask import Response, jsonify, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Tamanho aproximado de cada pedaco escrito na resposta
+CHUNK_SIZE = 64 * 1024
+
+
+def dumps(value):
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            pass  # chaves nao-str, inteiros enormes etc.
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def wants_ndjson():
+    accept = (request.headers.get("Accept") or "").lower()
+    return "application/x-ndjson" in accept or "application/ndjson" in accept
+
+
+def _buffered(parts):
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_json_array(items, prefix=b"", suffix=b""):
+    def parts():
+        yield prefix + b"["
+        for position, item in enumerate(items):
+            yield (b"," if position else b"") + dumps(item)
+        yield b"]" + suffix
+
+    return _buffered(parts())
+
+
+def iter_ndjson(items):
+    return _buffered(dumps(item) + b"\n" for item in items)
+
+
+def stream_listing(result, status, list_key="data"):
+    """Serializa ``result`` item a item em vez de montar o JSON inteiro.
+
+    Com ``Accept: application/x-ndjson`` devolve so os itens, um por linha;
+    senao devolve o mesmo envelope que o ``jsonify`` devolveria. Sempre
+    devolve um ``Response`` com o status ja aplicado.
+    """
+    items = result.get(list_key) if isinstance(result, dict) else None
+    if not isinstance(items, list):
+        response = jsonify(result)
+        response.status_code = status
+        return response
+
+    if wants_ndjson():
+        return Response(iter_ndjson(items), status=status, mimetype="application/x-ndjson")
+
+    envelope = {key: value for key, value in result.items() if key != list_key}
+    head = dumps(envelope)[:-1] + (b"," if envelope else b"") + dumps(list_key) + b":"
+    return Response(iter_json_array(items, prefix=head, suffix=b"}"), status=status, mimetype="application/json")
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from database_api import GoogleSheetsDB
+from rate_limit import UpstreamSaturated
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT UNIQUE NOT NULL,
+    vitrine_id TEXT,
+    acao TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    payload_hash TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_vitrine ON outbox(vitrine_id, id);
+"""
+
+# Proxima linha pendente cuja vitrine nao tem escrita anterior em aberto,
+# para que as escritas de uma mesma vitrine cheguem na ordem em que entraram.
+NEXT_PENDING = """
+SELECT id, payload, attempts FROM outbox AS o
+WHERE o.status = 'pending' AND o.next_attempt_at <= ?
+AND NOT EXISTS (
+    SELECT 1 FROM outbox AS p
+    WHERE p.vitrine_id IS o.vitrine_id AND p.id < o.id AND p.status IN ('pending', 'sending')
+)
+ORDER BY o.id LIMIT 1
+"""
+
+# Escritas que o Apps Script nao deduplica: repetir cria outra linha
+NON_IDEMPOTENT_ACTIONS = {"criar_moto", "criar_usuario"}
+
+
+class IdempotencyKeyReused(Exception):
+    """Idempotency-Key ja usada para uma escrita diferente."""
+
+
+def payload_hash(payload):
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class Outbox:
+    """Fila local (SQLite) de escritas para o Google Sheets.
+
+    A escrita e gravada com a Idempotency-Key do cliente e confirmada na hora;
+    uma thread por processo entrega em segundo plano, com novas tentativas e
+    backoff exponencial. Repetir a mesma chave com a mesma escrita devolve o
+    registro existente; com outra escrita levanta IdempotencyKeyReused.
+
+    criar_moto/criar_usuario so sao repetidos quando o pedido nao chegou ao
+    Apps Script (falha de conexao, limite local); timeout no meio da
+    resposta vira status ``unknown``, que o cliente confere antes de reenviar.
+    """
+
+    def __init__(self, path, db, max_attempts=8, backoff=2.0, lease=120):
+        self.path = path
+        self.db = db
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self._listeners = []
+        self._wakeup = threading.Event()
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "payload_hash" not in columns:  # arquivo criado antes da coluna
+                conn.execute("ALTER TABLE outbox ADD COLUMN payload_hash TEXT")
+
+    def subscribe(self, listener):
+        """Registra ``listener(payload, result)`` chamado apos cada entrega."""
+        self._listeners.append(listener)
+
+    def enqueue(self, idempotency_key, payload, vitrine_id=None):
+        now = time.time()
+        digest = payload_hash(payload)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO outbox "
+                "(idempotency_key, vitrine_id, acao, payload, payload_hash, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    idempotency_key,
+                    None if vitrine_id in (None, "") else str(vitrine_id),
+                    payload.get("acao", ""),
+                    json.dumps(payload, ensure_ascii=False),
+                    digest,
+                    now,
+                    now,
+                    now,
+                ),
+            )
+            stored = conn.execute(
+                "SELECT payload_hash FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        if stored is not None and stored[0] is not None and stored[0] != digest:
+            raise IdempotencyKeyReused(idempotency_key)
+        self.ensure_worker()
+        self._wakeup.set()
+        return self.status(idempotency_key)
+
+    def status(self, idempotency_key):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT idempotency_key, acao, vitrine_id, status, attempts, result, created_at, updated_at "
+                "FROM outbox WHERE idempotency_key = ?",
+                (idempotency_key,),
+            ).fetchone()
+        if row is None:
+            return None
+        key, acao, vitrine_id, status, attempts, result, created_at, updated_at = row
+        return {
+            "ok": status not in ("failed", "unknown"),
+            "idempotency_key": key,
+            "acao": acao,
+            "vitrine_id": vitrine_id,
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    ############################
+    # ENTREGA
+    ############################
+    def ensure_worker(self):
+        # Com gunicorn --preload a thread do master nao sobrevive ao fork;
+        # cada worker sobe a sua na primeira requisicao.
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._wakeup = threading.Event()
+            threading.Thread(target=self._run, name="outbox-worker", daemon=True).start()
+
+    def deliver_next(self):
+        claimed = self._claim()
+        if claimed is None:
+            return False
+
+        row_id, payload, attempts = claimed
+        try:
+            result = self.db.send_request(payload)
+        except UpstreamSaturated as exc:
+            result = {"erro": str(exc), "enviado": False}
+        except Exception as exc:
+            result = {"erro": str(exc)}
+
+        attempts += 1
+        if result.get("ok") or result.get("status") == "ok":
+            self._finish(row_id, "done", attempts, result)
+            self._notify(payload, result)
+        elif self._is_transient(result) and self._maybe_applied(payload, result):
+            # Repetir poderia duplicar a linha no Apps Script
+            logger.warning("Outbox: entrega %s (%s) sem confirmacao: %s", row_id, payload.get("acao"), result)
+            self._finish(row_id, "unknown", attempts, result)
+            self._notify(payload, result)
+        elif self._is_transient(result) and attempts < self.max_attempts:
+            delay = self.backoff ** attempts
+            logger.warning("Outbox: entrega %s falhou (tentativa %s), nova tentativa em %.0fs", row_id, attempts, delay)
+            self._retry(row_id, attempts, delay, result)
+        else:
+            logger.error("Outbox: entrega %s rejeitada apos %s tentativa(s): %s", row_id, attempts, result)
+            self._finish(row_id, "failed", attempts, result)
+        return True
+
+    def _run(self):
+        released_at = 0.0
+        while True:
+            try:
+                # Periodico, nao so no start: o worker que morreu no meio de uma
+                # entrega costuma ser substituido antes do lease expirar.
+                if time.time() - released_at >= self.lease / 4:
+                    self._release_stale()
+                    released_at = time.time()
+                if self.deliver_next():
+                    continue
+            except Exception:
+                logger.exception("Outbox: erro inesperado no worker")
+            self._wakeup.wait(1.0)
+            self._wakeup.clear()
+
+    def _claim(self):
+        # BEGIN IMMEDIATE serializa o claim entre os workers do gunicorn
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(NEXT_PENDING, (time.time(),)).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?",
+                        (time.time(), row[0]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        row_id, payload, attempts = row
+        return row_id, json.loads(payload), attempts
+
+    def _finish(self, row_id, status, attempts, result):
+        # O payload (que pode conter senha) nao e mais necessario
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, result = ?, payload = '{}', updated_at = ? WHERE id = ?",
+                (status, attempts, json.dumps(result, ensure_ascii=False), time.time(), row_id),
+            )
+
+    def _retry(self, row_id, attempts, delay, result):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, result = ?, next_attempt_at = ?, updated_at = ? "
+                "WHERE id = ?",
+                (attempts, json.dumps(result, ensure_ascii=False), now + delay, now, row_id),
+            )
+
+    def _release_stale(self):
+        # Linhas presas em 'sending' por um worker que morreu no meio da entrega
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND updated_at < ?",
+                (time.time() - self.lease,),
+            )
+
+    def _notify(self, payload, result):
+        for listener in self._listeners:
+            try:
+                listener(payload, result)
+            except Exception:
+                logger.exception("Outbox: erro no listener de entrega")
+
+    @staticmethod
+    def _maybe_applied(payload, result):
+        # "raw" (pagina de erro) e erros sem "enviado" contam como talvez aplicados
+        return payload.get("acao") in NON_IDEMPOTENT_ACTIONS and result.get("enviado", True)
+
+    @staticmethod
+    def _is_transient(result):
+        # {"erro": ...} vem de falha de rede/timeout no send_request e
+        # {"raw": ...} de pagina de erro do Apps Script; ambos valem retry,
+        # desde que a escrita nao possa ter sido aplicada (_maybe_applied).
+        if "status" in result or "ok" in result:
+            return False
+        return "erro" in result or "raw" in result
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+
+outbox = Outbox(
+    os.getenv("OUTBOX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox.sqlite3")),
+    GoogleSheetsDB(os.getenv("GOOGLE_SHEETS_API")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+)
@@ -0,0 +1,217 @@
+import hmac
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+
+logger = logging.getLogger(__name__)
+
+# Chamadas ao Apps Script da requisicao atual: [{"acao", "ms", "erro"}]
+upstream_calls = ContextVar("upstream_calls", default=None)
+
+
+def record_upstream(acao, started, error=None):
+    calls = upstream_calls.get()
+    if calls is not None:
+        calls.append({"acao": acao, "ms": round((time.perf_counter() - started) * 1000, 1), "erro": error})
+
+
+def collapse(frame):
+    """Pilha no formato "collapsed" do flamegraph.pl/speedscope (raiz primeiro)."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class ActiveRequest:
+    __slots__ = ("method", "path", "started", "forced", "samples", "calls", "token")
+
+    def __init__(self, method, path, forced, calls, token):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.forced = forced
+        self.samples = Counter()
+        self.calls = calls
+        self.token = token
+
+
+class RequestProfiler:
+    """Amostragem de pilha sob demanda e captura de requisicoes lentas.
+
+    Uma unica thread por processo visita as requisicoes em andamento a cada
+    ``interval`` segundos e amostra a pilha das que pediram profiling (header
+    secreto) ou ja passaram de ``slow_ms``. Os perfis ficam em ``directory``
+    como um anel de no maximo ``ring_size`` arquivos JSON.
+    """
+
+    def __init__(self, directory, secret="", slow_ms=1500, ring_size=50, interval=0.005):
+        self.directory = directory
+        self.secret = secret
+        self.slow_ms = slow_ms
+        self.ring_size = ring_size
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler_pid = None
+
+    @property
+    def enabled(self):
+        return bool(self.secret) or self.slow_ms > 0
+
+    def is_authorized(self, token):
+        return bool(self.secret) and bool(token) and hmac.compare_digest(token, self.secret)
+
+    def begin(self, method, path, forced=False):
+        if not self.enabled:
+            return None
+        self._ensure_sampler()
+        calls = []
+        active = ActiveRequest(method, path, forced, calls, upstream_calls.set(calls))
+        with self._lock:
+            self._active[threading.get_ident()] = active
+        self._wakeup.set()
+        return active
+
+    def end(self, active, status=None):
+        if active is None:
+            return None
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        try:
+            upstream_calls.reset(active.token)
+        except ValueError:  # end() chamado em outro contexto
+            upstream_calls.set(None)
+        elapsed_ms = (time.perf_counter() - active.started) * 1000
+        if not active.forced and (self.slow_ms <= 0 or elapsed_ms < self.slow_ms):
+            return None
+        return self._save(active, elapsed_ms, status)
+
+    def list_profiles(self):
+        try:
+            names = sorted((name for name in os.listdir(self.directory) if name.endswith(".json")), reverse=True)
+        except FileNotFoundError:
+            return []
+        profiles = []
+        for name in names:
+            profile = self.load(name[:-5])
+            if profile is not None:
+                profile.pop("stacks", None)
+                profiles.append(profile)
+        return profiles
+
+    def load(self, profile_id):
+        if not profile_id or os.path.basename(profile_id) != profile_id:
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".json"), encoding="utf-8") as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    ############################
+    # AMOSTRAGEM
+    ############################
+    def _ensure_sampler(self):
+        # Mesmo cuidado do outbox: com --preload cada worker sobe sua thread
+        if self._sampler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+            self._wakeup = threading.Event()
+            threading.Thread(target=self._run, name="request-profiler", daemon=True).start()
+
+    def _next_wait_locked(self):
+        """Segundos ate a proxima amostra: 0 ja amostra, None espera um begin()."""
+        if any(active.forced for active in self._active.values()):
+            return 0
+        if not self._active or self.slow_ms <= 0:
+            return None
+        deadline = min(active.started for active in self._active.values()) + self.slow_ms / 1000
+        return max(0, deadline - time.perf_counter())
+
+    def _run(self):
+        while True:
+            # Sem requisicao forcada, dorme ate a mais antiga virar lenta em vez
+            # de acordar a cada intervalo; begin() acorda para recalcular.
+            with self._lock:
+                wait = self._next_wait_locked()
+                if wait != 0:
+                    self._wakeup.clear()
+            if wait != 0:
+                self._wakeup.wait(wait)
+                continue
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                targets = [
+                    (thread_id, active)
+                    for thread_id, active in self._active.items()
+                    if active.forced or (self.slow_ms > 0 and (now - active.started) * 1000 >= self.slow_ms)
+                ]
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for thread_id, active in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    active.samples[collapse(frame)] += 1
+
+    def _save(self, active, elapsed_ms, status):
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        profile = {
+            "id": profile_id,
+            "kind": "on_demand" if active.forced else "slow",
+            "method": active.method,
+            "path": active.path,
+            "status": status,
+            "duration_ms": round(elapsed_ms, 1),
+            "created_at": time.time(),
+            "pid": os.getpid(),
+            "interval_ms": self.interval * 1000,
+            "samples": sum(active.samples.values()),
+            "upstream": active.calls,
+            "upstream_ms": round(sum(call["ms"] for call in active.calls), 1),
+            "stacks": "\n".join(f"{stack} {count}" for stack, count in active.samples.most_common()),
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(profile, handle, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.directory, profile_id + ".json"))
+            self._trim()
+        except OSError:
+            logger.exception("Falha ao gravar perfil da requisicao %s", active.path)
+            return None
+        logger.warning("Perfil %s salvo: %s %s em %.0fms", profile_id, active.method, active.path, elapsed_ms)
+        return profile_id
+
+    def _trim(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in names[:-self.ring_size] if len(names) > self.ring_size else []:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+profiler = RequestProfiler(
+    os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "vitrine_profiles")),
+    secret=os.getenv("PROFILE_SECRET", ""),
+    slow_ms=float(os.getenv("SLOW_REQUEST_MS", "1500")),
+    ring_size=int(os.getenv("PROFILE_RING_SIZE", "50")),
+)
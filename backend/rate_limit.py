@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import jsonify, request
+
+
+# Limites padrao por rota: escopo -> "capacidade/segundos".
+# Sobrescreva com RATE_LIMITS="login:ip=5/60,metrics_view:vitrine=600/60".
+DEFAULT_RULES = {
+    "login": {"ip": "10/60"},
+    "register": {"ip": "5/60"},
+    "metrics_view": {"ip": "30/60", "vitrine": "600/60"},
+    "metrics_lead": {"ip": "5/60", "vitrine": "60/60"},
+    "teste_sheets": {"ip": "2/60"},
+}
+
+# Teto de baldes em memoria; acima dele sai o usado ha mais tempo
+MAX_BUCKETS = 50000
+
+
+class UpstreamSaturated(Exception):
+    pass
+
+
+def parse_rule(value):
+    capacity, _, seconds = value.partition("/")
+    capacity = float(capacity)
+    return capacity, capacity / float(seconds or 1)
+
+
+def parse_rules(spec, defaults=None):
+    rules = {route: dict(scopes) for route, scopes in (defaults or {}).items()}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        target, _, value = item.partition("=")
+        route, _, scope = target.partition(":")
+        rules.setdefault(route.strip(), {})[scope.strip() or "ip"] = value.strip()
+    return {
+        route: {scope: parse_rule(value) for scope, value in scopes.items()}
+        for route, scopes in rules.items()
+    }
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def retry_after(self, now):
+        """Repoe os tokens ate ``now``; 0 se ha um token para gastar."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else float("inf")
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """Baldes de tokens por rota, por IP do cliente e por vitrine.
+
+    O estado fica no processo: com varios workers do gunicorn cada um tem os
+    seus baldes, entao o limite efetivo e o configurado vezes o numero de
+    workers. Os baldes ficam em ordem de uso (LRU): os do inicio que ja
+    encheram de novo sao descartados a cada chamada e, acima de
+    ``MAX_BUCKETS``, sai o mais antigo; as duas coisas sao O(1) amortizado.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def check(self, route, keys):
+        """Retorna ``(escopo, retry_after)`` do primeiro limite estourado, ou None."""
+        scopes = self.rules.get(route)
+        if not scopes:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            buckets = [
+                (scope, self._bucket((route, scope, keys[scope]), capacity, rate))
+                for scope, (capacity, rate) in scopes.items()
+                if keys.get(scope) not in (None, "")
+            ]
+            # Todos os escopos antes de gastar: rejeitado por vitrine nao
+            # consome o token do IP
+            for scope, bucket in buckets:
+                retry_after = bucket.retry_after(now)
+                if retry_after:
+                    self._count(route, "rejected_" + scope)
+                    return scope, retry_after
+            for _scope, bucket in buckets:
+                bucket.tokens -= 1
+            self._count(route, "allowed")
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buckets": len(self._buckets),
+                "routes": {route: dict(counts) for route, counts in self.counters.items()},
+                "rules": {
+                    route: {scope: {"capacity": capacity, "per_second": rate} for scope, (capacity, rate) in scopes.items()}
+                    for route, scopes in self.rules.items()
+                },
+            }
+
+    def _count(self, route, name):
+        counts = self.counters.setdefault(route, {})
+        counts[name] = counts.get(name, 0) + 1
+
+    def _bucket(self, key, capacity, rate):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+        bucket = self._buckets[key] = TokenBucket(capacity, rate)
+        if len(self._buckets) > MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def _evict_idle(self, now):
+        # Balde cheio equivale a um novo: pode sair sem mudar nenhum limite
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if not bucket.is_full(now):
+                break
+            del self._buckets[key]
+
+
+class UpstreamGate:
+    """Limite global de chamadas simultaneas ao Apps Script, com fila curta."""
+
+    def __init__(self, max_in_flight, queue_size, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.counters = {"acquired": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.queue_size:
+                    self.counters["rejected_queue_full"] += 1
+                    raise UpstreamSaturated("Fila de chamadas ao Google Sheets cheia")
+                self.waiting += 1
+                self.counters["queued"] += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.counters["rejected_timeout"] += 1
+                            raise UpstreamSaturated("Tempo de espera por chamada ao Google Sheets esgotado")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.counters["acquired"] += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_in_flight": self.max_in_flight,
+                "queue_size": self.queue_size,
+                **self.counters,
+            }
+
+
+limiter = RateLimiter(parse_rules(os.getenv("RATE_LIMITS"), DEFAULT_RULES))
+upstream_gate = UpstreamGate(
+    max_in_flight=int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", "8")),
+    queue_size=int(os.getenv("UPSTREAM_QUEUE_SIZE", "16")),
+    queue_timeout=float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "2")),
+)
+
+
+def _vitrine_key():
+    view_args = request.view_args or {}
+    for name in ("vitrine_id", "slug"):
+        if view_args.get(name) not in (None, ""):
+            return str(view_args[name])
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict):
+        for name in ("vitrine_id", "slug"):
+            if data.get(name) not in (None, ""):
+                return str(data[name])
+    return request.args.get("vitrine_id") or request.args.get("slug")
+
+
+def rate_limited(route, methods=("POST",)):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in methods:
+                # remote_addr ja vem resolvido pelo ProxyFix
+                blocked = limiter.check(route, {"ip": request.remote_addr, "vitrine": _vitrine_key()})
+                if blocked:
+                    scope, retry_after = blocked
+                    response = jsonify({"ok": False, "error": "Muitas requisicoes, tente novamente em instantes", "scope": scope})
+                    response.status_code = 429
+                    response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+                    return response
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
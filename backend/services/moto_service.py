@@ -1,19 +1,88 @@
 from database_api import GoogleSheetsDB
+from catalog_snapshot import catalog, card_fields
+from inventory_versions import inventory_versions
+from outbox import outbox
+from similarity import similar_bikes
 import os
 
+
+def _written_id(payload, result):
+    if payload.get('moto_id') is not None:
+        return payload['moto_id']
+    if isinstance(result, dict):
+        data = result.get('data')
+        return result.get('id') or (data.get('id') if isinstance(data, dict) else None)
+    return None
+
+
+MOTO_ACTIONS = {'criar_moto', 'editar_moto', 'excluir_moto'}
+
+
+def on_moto_written(payload, result):
+    # O outbox notifica toda entrega (inclusive criar_usuario); so motos
+    # mexem no catalogo e no indice de similares
+    if payload.get('acao') not in MOTO_ACTIONS:
+        return
+    catalog.discard(vitrine_id=payload.get('vitrine_id'), moto_id=payload.get('moto_id'))
+    if not (result.get('ok') or result.get('status') == 'ok'):
+        return
+
+    # Indice de similares atualizado na hora, sem esperar recarregar a vitrine
+    moto_id = _written_id(payload, result)
+    if moto_id is None:
+        return
+    if payload.get('acao') == 'excluir_moto':
+        similar_bikes.remove(moto_id)
+        inventory_versions.mark_deleted(moto_id, payload.get('vitrine_id'))
+        return
+    fields = {key: value for key, value in payload.items() if key not in ('acao', 'moto_id')}
+    similar_bikes.upsert(card_fields({**fields, 'id': moto_id}), payload.get('vitrine_id'))
+
+
+outbox.subscribe(on_moto_written)
+
+
 class MotoService:
     def __init__(self):
         self.db = GoogleSheetsDB(os.getenv('GOOGLE_SHEETS_API'))
 
-    def criar_moto(self, data):
-        return self.db.criar_moto(**data)
+    def criar_moto(self, data, idempotency_key=None):
+        if idempotency_key:
+            return outbox.enqueue(idempotency_key, {"acao": "criar_moto", **data}, data.get('vitrine_id'))
+        result = self.db.criar_moto(**data)
+        on_moto_written({"acao": "criar_moto", **data}, result)
+        return result
 
-    def editar_moto(self, moto_id, data):
+    def editar_moto(self, moto_id, data, idempotency_key=None):
         data['moto_id'] = moto_id
-        return self.db.editar_moto(**data)
+        if idempotency_key:
+            return outbox.enqueue(idempotency_key, {"acao": "editar_moto", **data}, data.get('vitrine_id'))
+        result = self.db.editar_moto(**data)
+        on_moto_written({"acao": "editar_moto", **data}, result)
+        return result
+
+    def excluir_moto(self, moto_id, vitrine_id=None, idempotency_key=None):
+        payload = {"moto_id": moto_id}
+        if idempotency_key:
+            return outbox.enqueue(idempotency_key, {"acao": "excluir_moto", **payload}, vitrine_id)
+        result = self.db.excluir_moto(moto_id)
+        on_moto_written({"acao": "excluir_moto", "vitrine_id": vitrine_id, **payload}, result)
+        return result
 
-    def excluir_moto(self, moto_id):
-        return self.db.excluir_moto(moto_id)
+    def listar_motos(self, vitrine_id, since=None):
+        result = self.db.listar_motos(vitrine_id)
+        if not (result.get('ok') and isinstance(result.get('data'), list)):
+            return result
 
-    def listar_motos(self, vitrine_id):
-        return self.db.listar_motos(vitrine_id)
+        version, stamps = inventory_versions.reconcile(vitrine_id, result['data'])
+        # since acima da versao atual: cliente com cache de outra base, manda tudo
+        if since is None or since > version:
+            return {**result, "version": version, "full": True}
+        changed = [moto for moto in result['data'] if stamps.get(str(moto.get('id')), 0) > since]
+        return {
+            **result,
+            "data": changed,
+            "deleted": inventory_versions.tombstones(vitrine_id, since),
+            "version": version,
+            "full": False,
+        }
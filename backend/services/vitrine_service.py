@@ -1,16 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
 from database_api import GoogleSheetsDB
+from catalog_snapshot import catalog, card_fields
+from similarity import similar_bikes
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
 
 class VitrineService:
     def __init__(self):
         self.db = GoogleSheetsDB(os.getenv('GOOGLE_SHEETS_API'))
 
     def get_vitrine_by_slug(self, slug):
+        cached = catalog.get(slug)
+        if cached is not None:
+            return {"ok": True, "data": cached["vitrine"]}
         return self.db.buscar_vitrine(slug)
 
     def get_motos_by_vitrine(self, slug):
+        cached = catalog.get(slug)
+        if cached is not None:
+            return {"ok": True, "data": cached["motos"]}
+
+        fetched_at = time.time()
         vitrine = self.db.buscar_vitrine(slug)
         if vitrine.get('ok'):
             vitrine_id = vitrine.get('data', {}).get('id')
-            return self.db.listar_motos(vitrine_id)
+            motos = self.db.listar_motos(vitrine_id)
+            if motos.get('ok') and isinstance(motos.get('data'), list):
+                # Aquece o snapshot compartilhado para os demais workers
+                catalog.put(slug, vitrine.get('data'), motos['data'], fetched_at)
+                return {**motos, "data": [card_fields(moto) for moto in motos['data']]}
+            return motos
         return {"ok": False, "error": "Vitrine não encontrada"}
+
+    def aquecer_catalogo(self, slugs=()):
+        """Publica o snapshot com as vitrines conhecidas; roda no preload do app.
+
+        Conhecidas = ``slugs`` + as que ja estavam no snapshot anterior.
+        """
+        slugs = sorted(set(slugs) | {entry['slug'] for entry in catalog.entries(include_expired=True)})
+        if not slugs:
+            return 0
+        fetched_at = time.time()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            loaded = dict(zip(slugs, executor.map(self._buscar_catalogo, slugs)))
+        loaded = {slug: entry for slug, entry in loaded.items() if entry is not None}
+        if loaded:
+            catalog.publish(loaded, fetched_at)
+        return len(loaded)
+
+    def _buscar_catalogo(self, slug):
+        try:
+            vitrine = self.db.buscar_vitrine(slug)
+            if not vitrine.get('ok'):
+                return None
+            motos = self.db.listar_motos(vitrine.get('data', {}).get('id'))
+        except Exception:
+            logger.exception("Falha ao aquecer o catalogo da vitrine %s", slug)
+            return None
+        if not (motos.get('ok') and isinstance(motos.get('data'), list)):
+            return None
+        return vitrine['data'], motos['data']
+
+    def get_similares(self, slug, moto_id, k=6, escopo='vitrine'):
+        cached = catalog.get(slug)
+        if cached is None:
+            # Aquece o snapshot e le de novo
+            if not self.get_motos_by_vitrine(slug).get('ok'):
+                return {"ok": False, "error": "Vitrine não encontrada"}
+            cached = catalog.get(slug)
+        if cached is None:
+            return {"ok": False, "error": "Vitrine não encontrada"}
+
+        vitrine_id = cached['vitrine'].get('id')
+        similar_bikes.ensure_vitrine(cached['vitrine'], cached['motos'])
+        return {"ok": True, "data": similar_bikes.similares(vitrine_id, moto_id, k, escopo)}
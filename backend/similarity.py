@@ -0,0 +1,427 @@
+import logging
+import os
+import re
+import threading
+import time
+import warnings
+import zlib
+
+import numpy as np
+
+from catalog_snapshot import catalog
+
+
+logger = logging.getLogger(__name__)
+
+
+# Nomes aceitos para cada campo (Apps Script usa portugues, Produto ingles)
+FIELD_ALIASES = {
+    "price": ("price", "preco", "valor"),
+    "year": ("year", "ano"),
+    "km": ("km", "quilometragem"),
+    "color": ("color", "cor"),
+    "name": ("name", "nome", "modelo", "titulo"),
+}
+
+# Unicos campos devolvidos pelo endpoint publico de similares
+CARD_FIELDS = frozenset(
+    alias for aliases in FIELD_ALIASES.values() for alias in aliases
+) | {"id", "vitrine_id", "categoria", "descricao", "description", "destaque", "is_featured",
+     "marca", "cilindrada", "status", "imagem", "image_url", "foto", "capa"}
+
+COLOR_DIMS = 8
+NAME_DIMS = 32
+DIMS = 3 + COLOR_DIMS + NAME_DIMS
+
+# Escalas fixas: nao dependem do conteudo do indice, entao inserir ou remover
+# uma moto nao obriga a renormalizar as demais.
+PRICE_SCALE = 0.35   # ~40% de diferenca de preco vale 1 unidade
+YEAR_SCALE = 4.0     # 4 anos valem 1 unidade
+KM_SCALE = 1.0       # km em escala log
+COLOR_WEIGHT = 0.5
+NAME_WEIGHT = 1.5
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+THOUSANDS_RE = re.compile(r"^-?\d{1,3}(\.\d{3})+$")
+
+
+def _field(moto, name):
+    for alias in FIELD_ALIASES[name]:
+        value = moto.get(alias)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _number(value):
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        value = value.replace("R$", "").strip()
+        # "." so e milhar no formato brasileiro: com "," decimal ou "12.500"
+        if "," in value:
+            value = value.replace(".", "").replace(",", ".")
+        elif THOUSANDS_RE.match(value):
+            value = value.replace(".", "")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _bucket(token, dims):
+    return zlib.crc32(token.encode()) % dims
+
+
+def _raw_fields(moto):
+    return (
+        _number(_field(moto, "price")),
+        _number(_field(moto, "year")),
+        _number(_field(moto, "km")),
+        str(_field(moto, "color") or "").strip().lower(),
+        TOKEN_RE.findall(str(_field(moto, "name") or "").lower()),
+    )
+
+
+def feature_matrix(motos, fill_missing=True):
+    """Matriz (DIMS, n) de um lote de motos, uma coluna por moto.
+
+    So a extracao dos campos e por linha; escalas, hashing das cores/nomes e
+    normalizacao saem vetorizadas. Com ``fill_missing`` os numericos
+    ausentes assumem a media do lote, senao ficam NaN.
+    """
+    count = len(motos)
+    matrix = np.zeros((DIMS, count), dtype=np.float32)
+    numeric = np.full((3, count), np.nan)
+    color_rows, color_cols, name_rows, name_cols = [], [], [], []
+    for column, moto in enumerate(motos):
+        price, year, km, color, tokens = _raw_fields(moto)
+        numeric[:, column] = (price, year, km)
+        if color:
+            color_rows.append(3 + _bucket(color, COLOR_DIMS))
+            color_cols.append(column)
+        for token in tokens:
+            name_rows.append(_bucket(token, NAME_DIMS))
+            name_cols.append(column)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        numeric[0] = np.where(numeric[0] >= 0, np.log1p(numeric[0]) / PRICE_SCALE, np.nan)
+        numeric[1] = numeric[1] / YEAR_SCALE
+        numeric[2] = np.where(numeric[2] >= 0, np.log1p(numeric[2]) / KM_SCALE, np.nan)
+    if fill_missing and count:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # coluna toda NaN
+            means = np.nan_to_num(np.nanmean(numeric, axis=1))
+        numeric = np.where(np.isnan(numeric), means[:, None], numeric)
+    matrix[:3] = numeric
+    matrix[color_rows, color_cols] = COLOR_WEIGHT
+
+    names = np.zeros((NAME_DIMS, count), dtype=np.float32)
+    np.add.at(names, (np.asarray(name_rows, dtype=np.intp), np.asarray(name_cols, dtype=np.intp)), 1)
+    norms = np.linalg.norm(names, axis=0)
+    matrix[3 + COLOR_DIMS:] = names / np.where(norms > 0, norms, 1) * NAME_WEIGHT
+    return matrix
+
+
+def features(moto):
+    """Vetor (DIMS,) de uma moto; campos numericos ausentes ficam NaN."""
+    return feature_matrix([moto], fill_missing=False)[:, 0]
+
+
+class SimilarityIndex:
+    """Matriz de features de um grupo de motos com busca k-NN vetorizada.
+
+    Cada moto e uma coluna de uma matriz (DIMS, capacidade), dobrada sob
+    demanda; remocao troca a coluna pela ultima. Guardar por coluna deixa o
+    produto vetor-matriz lendo memoria contigua, e as normas ao quadrado
+    mantidas fazem a distancia sair desse unico produto.
+    """
+
+    def __init__(self, capacity=64):
+        self._matrix = np.zeros((DIMS, capacity), dtype=np.float32)
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        self._ids = []
+        self._items = []
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, motos):
+        """Indice montado de uma vez, com a matriz de features do lote inteiro."""
+        unique = {}
+        for moto in motos:
+            if isinstance(moto, dict) and moto.get("id") is not None:
+                unique[str(moto["id"])] = moto
+        index = cls(capacity=max(64, len(unique)))
+        if unique:
+            matrix = feature_matrix(list(unique.values()))
+            index._store(list(unique), list(unique.values()), matrix, np.einsum("ij,ij->j", matrix, matrix))
+        return index
+
+    @classmethod
+    def concat(cls, indexes):
+        """Junta indices ja montados (ex.: vitrines de uma cidade) sem recalcular features."""
+        parts = []
+        for part in indexes:
+            with part._lock:
+                count = len(part._ids)
+                parts.append((list(part._ids), list(part._items), part._matrix[:, :count].copy(), part._norms[:count].copy()))
+        count = sum(len(ids) for ids, _items, _matrix, _norms in parts)
+        index = cls(capacity=max(64, count))
+        if count:
+            index._store(
+                [moto_id for ids, _items, _matrix, _norms in parts for moto_id in ids],
+                [item for _ids, items, _matrix, _norms in parts for item in items],
+                np.hstack([matrix for _ids, _items, matrix, _norms in parts]),
+                np.concatenate([norms for _ids, _items, _matrix, norms in parts]),
+            )
+        return index
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, moto_id):
+        return str(moto_id) in self._rows
+
+    def items(self):
+        with self._lock:
+            return list(self._items)
+
+    def upsert(self, moto):
+        moto_id = str(moto.get("id"))
+        with self._lock:
+            row = self._rows.get(moto_id)
+            if row is not None:
+                # Edicoes podem mandar so os campos alterados
+                moto = {**self._items[row], **moto}
+            vector = features(moto)
+            self._fill_missing(vector)
+            if row is None:
+                row = len(self._ids)
+                self._grow(row + 1)
+                self._ids.append(moto_id)
+                self._items.append(moto)
+                self._rows[moto_id] = row
+            else:
+                self._items[row] = moto
+            self._matrix[:, row] = vector
+            self._norms[row] = vector @ vector
+
+    def remove(self, moto_id):
+        moto_id = str(moto_id)
+        with self._lock:
+            row = self._rows.pop(moto_id, None)
+            if row is None:
+                return
+            last = len(self._ids) - 1
+            if row != last:
+                self._matrix[:, row] = self._matrix[:, last]
+                self._norms[row] = self._norms[last]
+                self._ids[row] = self._ids[last]
+                self._items[row] = self._items[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            self._items.pop()
+
+    def nearest(self, moto_id, k):
+        moto_id = str(moto_id)
+        with self._lock:
+            row = self._rows.get(moto_id)
+            count = len(self._ids)
+            if row is None or count < 2:
+                return []
+            # |a - b|^2 sem o termo |a|^2, que e constante para a consulta
+            vector = self._matrix[:, row].copy()
+            distances = self._norms[:count] - 2 * (vector @ self._matrix[:, :count])
+            distances[row] = np.inf
+            k = min(k, count - 1)
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest])]
+            return [
+                {key: value for key, value in self._items[position].items() if key in CARD_FIELDS}
+                for position in nearest
+            ]
+
+    def _store(self, ids, items, matrix, norms):
+        count = len(ids)
+        self._matrix[:, :count] = matrix
+        self._norms[:count] = norms
+        self._ids = ids
+        self._items = items
+        self._rows = {moto_id: row for row, moto_id in enumerate(ids)}
+
+    def _grow(self, size):
+        capacity = self._matrix.shape[1]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        matrix = np.zeros((DIMS, capacity), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float32)
+        matrix[:, :len(self._ids)] = self._matrix[:, :len(self._ids)]
+        norms[:len(self._ids)] = self._norms[:len(self._ids)]
+        self._matrix = matrix
+        self._norms = norms
+
+    def _fill_missing(self, vector):
+        # Campo numerico ausente assume a media do grupo (neutro na distancia)
+        missing = np.isnan(vector[:3])
+        if not missing.any():
+            return
+        count = len(self._ids)
+        means = self._matrix[:3, :count].mean(axis=1) if count else np.zeros(3, dtype=np.float32)
+        vector[:3][missing] = np.nan_to_num(means[missing])
+
+
+def _city(vitrine):
+    return str(vitrine.get("city") or vitrine.get("cidade") or "").strip().lower()
+
+
+def _tagged(motos, vitrine_id):
+    return [
+        {**moto, "vitrine_id": moto.get("vitrine_id", vitrine_id)}
+        for moto in motos or []
+        if isinstance(moto, dict) and moto.get("id") is not None
+    ]
+
+
+class SimilarBikes:
+    """Indices por vitrine e por cidade, mantidos em memoria no worker.
+
+    Uma thread por processo remonta todos os indices a cada ``interval``
+    segundos a partir de ``source`` (as vitrines do snapshot do catalogo),
+    entao o indice por cidade cobre todas as vitrines conhecidas e nenhuma
+    requisicao paga o rebuild. Escritas feitas neste worker atualizam os
+    indices na hora.
+    """
+
+    def __init__(self, source=None, interval=60):
+        self.source = source
+        self.interval = interval
+        self._indexes = {}
+        self._vitrine_city = {}
+        self._pending = None
+        self._refresher_pid = None
+        self._lock = threading.Lock()
+
+    def ensure_vitrine(self, vitrine, motos):
+        """Indice da vitrine para o primeiro pedido do worker; o resto vem do rebuild."""
+        self._ensure_refresher()
+        if ("vitrine", str(vitrine.get("id"))) not in self._indexes:
+            self.load_vitrine(vitrine, motos)
+
+    def load_vitrine(self, vitrine, motos):
+        vitrine_id = str(vitrine.get("id"))
+        index = SimilarityIndex.build(_tagged(motos, vitrine.get("id")))
+        with self._lock:
+            self._indexes[("vitrine", vitrine_id)] = index
+            self._vitrine_city[vitrine_id] = _city(vitrine)
+
+    def rebuild(self, entries):
+        """Remonta todos os indices de uma vez a partir de entradas do catalogo."""
+        with self._lock:
+            previous = dict(self._indexes)
+            cities = dict(self._vitrine_city)
+            self._pending = []
+        try:
+            indexes = {}
+            for entry in entries:
+                vitrine = entry.get("vitrine") if isinstance(entry.get("vitrine"), dict) else {}
+                if vitrine.get("id") is None:
+                    continue
+                vitrine_id = str(vitrine["id"])
+                cities[vitrine_id] = _city(vitrine)
+                indexes[("vitrine", vitrine_id)] = SimilarityIndex.build(_tagged(entry.get("motos"), vitrine["id"]))
+            # Vitrine invalidada no catalogo por uma escrita: fica o indice atual
+            for key, index in previous.items():
+                if key[0] == "vitrine":
+                    indexes.setdefault(key, index)
+
+            by_city = {}
+            for (_kind, vitrine_id), index in list(indexes.items()):
+                if cities.get(vitrine_id):
+                    by_city.setdefault(cities[vitrine_id], []).append(index)
+            for city, parts in by_city.items():
+                indexes[("cidade", city)] = SimilarityIndex.concat(parts)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._indexes = indexes
+            self._vitrine_city = cities
+        # Escritas que chegaram durante a montagem
+        for method, args in pending:
+            method(*args)
+
+    def upsert(self, moto, vitrine_id=None):
+        """Insere/atualiza a moto; sem ``vitrine_id`` so atualiza onde ja existe."""
+        moto_id = moto.get("id")
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.upsert, (moto, vitrine_id)))
+            if vitrine_id is not None:
+                indexes = self._indexes_for(vitrine_id)
+            else:
+                indexes = [index for index in self._indexes.values() if moto_id in index]
+        for index in indexes:
+            index.upsert(moto if vitrine_id is None else {**moto, "vitrine_id": vitrine_id})
+
+    def remove(self, moto_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.remove, (moto_id,)))
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            index.remove(moto_id)
+
+    def similares(self, vitrine_id, moto_id, k=6, escopo="vitrine"):
+        vitrine_id = str(vitrine_id)
+        if escopo == "cidade":
+            key = ("cidade", self._vitrine_city.get(vitrine_id, ""))
+        else:
+            key = ("vitrine", vitrine_id)
+        index = self._indexes.get(key)
+        return index.nearest(moto_id, k) if index is not None else []
+
+    def _indexes_for(self, vitrine_id):
+        vitrine_id = str(vitrine_id)
+        indexes = []
+        if ("vitrine", vitrine_id) in self._indexes:
+            indexes.append(self._indexes[("vitrine", vitrine_id)])
+            city = self._vitrine_city.get(vitrine_id)
+            if city and ("cidade", city) in self._indexes:
+                indexes.append(self._indexes[("cidade", city)])
+        return indexes
+
+    ############################
+    # REBUILD EM SEGUNDO PLANO
+    ############################
+    def _ensure_refresher(self):
+        # Mesmo cuidado do outbox: com --preload cada worker sobe sua thread
+        if self.source is None or self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._run, name="similar-bikes", daemon=True).start()
+
+    def _run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                self.rebuild(self.source())
+                logger.info("Indice de similares remontado em %.0fms", (time.perf_counter() - started) * 1000)
+            except Exception:
+                logger.exception("Falha ao remontar o indice de similares")
+            time.sleep(self.interval)
+
+
+# Expiradas tambem entram: o indice por cidade deve cobrir todas as vitrines conhecidas
+similar_bikes = SimilarBikes(
+    lambda: catalog.entries(include_expired=True),
+    interval=int(os.getenv("SIMILAR_REFRESH_SECONDS", "60")),
+)
@@ -73,3 +73,61 @@ CREATE POLICY "API pode inserir users" ON users FOR INSERT WITH CHECK (true);
 CREATE POLICY "API pode ler users" ON users FOR SELECT USING (true);
 CREATE POLICY "API pode inserir vitrines" ON vitrines FOR ALL USING (true);
 CREATE POLICY "API pode inserir produtos" ON produtos FOR ALL USING (true);
+
+-- Delta-sync de produtos: GET /api/produtos?vitrine_id=X&since=V
+-- Cada inserção/edição recebe um row_version novo de uma sequência global;
+-- exclusões deixam um tombstone com a versão em que aconteceram.
+CREATE SEQUENCE IF NOT EXISTS produtos_row_version_seq;
+
+ALTER TABLE produtos ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT nextval('produtos_row_version_seq');
+CREATE INDEX IF NOT EXISTS idx_produtos_vitrine_version ON produtos(vitrine_id, row_version);
+
+CREATE TABLE IF NOT EXISTS produto_tombstones (
+    produto_id INTEGER PRIMARY KEY,
+    vitrine_id INTEGER,
+    row_version BIGINT NOT NULL DEFAULT nextval('produtos_row_version_seq'),
+    deleted_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_tombstones_vitrine_version ON produto_tombstones(vitrine_id, row_version);
+
+-- A API usa a chave sujeita a RLS e produto_tombstones só tem política de
+-- leitura: as triggers rodam como dono (SECURITY DEFINER) com search_path fixo.
+-- Sem isso o INSERT do tombstone é negado e aborta o DELETE do produto.
+CREATE OR REPLACE FUNCTION produtos_bump_row_version() RETURNS TRIGGER
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+    NEW.row_version := nextval('public.produtos_row_version_seq');
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION produtos_tombstone() RETURNS TRIGGER
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+    INSERT INTO public.produto_tombstones (produto_id, vitrine_id)
+    VALUES (OLD.id, OLD.vitrine_id)
+    ON CONFLICT (produto_id) DO UPDATE
+        SET vitrine_id = EXCLUDED.vitrine_id,
+            row_version = nextval('public.produtos_row_version_seq'),
+            deleted_at = NOW();
+    RETURN OLD;
+END;
+$$;
+
+-- Só as triggers chamam essas funções
+REVOKE EXECUTE ON FUNCTION produtos_bump_row_version() FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION produtos_tombstone() FROM PUBLIC;
+
+-- O DEFAULT de row_version no INSERT roda com o papel da API
+GRANT USAGE ON SEQUENCE produtos_row_version_seq TO anon, authenticated;
+
+DROP TRIGGER IF EXISTS produtos_row_version ON produtos;
+CREATE TRIGGER produtos_row_version BEFORE UPDATE ON produtos
+    FOR EACH ROW EXECUTE FUNCTION produtos_bump_row_version();
+
+DROP TRIGGER IF EXISTS produtos_delete_tombstone ON produtos;
+CREATE TRIGGER produtos_delete_tombstone AFTER DELETE ON produtos
+    FOR EACH ROW EXECUTE FUNCTION produtos_tombstone();
+
+ALTER TABLE produto_tombstones ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Tombstones públicos" ON produto_tombstones FOR SELECT USING (true);